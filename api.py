@@ -0,0 +1,147 @@
+import json
+from collections import defaultdict
+from datetime import datetime
+from flask import Blueprint, Response, abort, current_app, request, stream_with_context
+from models import db, Venue, Artist, Show, Genre, VenueGenre, ArtistGenre
+from util import parse_date
+
+#----------------------------------------------------------------------------#
+# Read API.
+#----------------------------------------------------------------------------#
+
+# Every endpoint streams rows straight off a server-side cursor (yield_per),
+# as NDJSON by default or as one chunked JSON array with ?format=json, so a
+# full catalog pull runs in constant memory. Genres are looked up once per
+# batch of rows.
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+_FILTERS = {
+  Venue: {'city': Venue.city, 'state': Venue.state},
+  Artist: {'city': Artist.city, 'state': Artist.state},
+  Show: {'venue_id': Show.venue_id, 'artist_id': Show.artist_id},
+}
+
+_GENRES = {Venue: VenueGenre.c.venue_id, Artist: ArtistGenre.c.artist_id}
+
+
+def _fields(model):
+  columns = model.__table__.columns
+  available = list(columns.keys()) + (['genres'] if model in _GENRES else [])
+  fields = request.args.get('fields')
+  if not fields:
+    return available
+  names = [name.strip() for name in fields.split(',') if name.strip()]
+  unknown = [name for name in names if name not in available]
+  if unknown:
+    abort(400, 'Unknown fields: ' + ', '.join(unknown))
+  return names
+
+
+def _with_genres(model, records, batch_size):
+  owner = _GENRES[model]
+  batch = []
+  for record in records:
+    batch.append(record)
+    if len(batch) >= batch_size:
+      yield from _attach_genres(owner, batch)
+      batch = []
+  yield from _attach_genres(owner, batch)
+
+
+def _attach_genres(owner, batch):
+  if not batch:
+    return
+  genres = defaultdict(list)
+  rows = db.session.query(owner, Genre.name) \
+    .join(Genre, Genre.id == owner.table.c.genre_id) \
+    .filter(owner.in_([record['id'] for record in batch])) \
+    .order_by(Genre.name)
+  for owner_id, name in rows:
+    genres[owner_id].append(name)
+  for record in batch:
+    record['genres'] = genres[record['id']]
+    yield record
+
+
+def _query(model, columns):
+  query = db.session.query(*columns)
+  for name, column in _FILTERS[model].items():
+    if name in request.args:
+      query = query.filter(column == request.args[name])
+
+  updated_since = request.args.get('updated_since', type=datetime.fromisoformat)
+  if updated_since is not None:
+    query = query.filter(model.updated_at >= updated_since)
+  if model is Show:
+    start = request.args.get('from', type=parse_date)
+    end = request.args.get('to', type=parse_date)
+    if start is not None:
+      query = query.filter(Show.start_time >= start)
+    if end is not None:
+      query = query.filter(Show.start_time < end)
+
+  # resume a sync from the last id seen
+  after_id = request.args.get('after_id', type=int)
+  if after_id is not None:
+    query = query.filter(model.id > after_id)
+
+  return query.order_by(model.id) \
+    .execution_options(stream_results=True) \
+    .yield_per(current_app.config['API_STREAM_BATCH_SIZE'])
+
+
+def _json_default(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+  raise TypeError(repr(value))
+
+
+def _records(model, fields):
+  table = model.__table__
+  names = [name for name in fields if name in table.columns]
+  with_genres = 'genres' in fields
+  if with_genres and 'id' not in names:
+    names.append('id')
+  rows = _query(model, [table.columns[name] for name in names])
+
+  records = (dict(zip(names, row)) for row in rows)
+  if not with_genres:
+    return records
+  records = _with_genres(model, records, current_app.config['API_STREAM_BATCH_SIZE'])
+  if 'id' in fields:
+    return records
+  return ({name: value for name, value in record.items() if name != 'id'} for record in records)
+
+
+def _stream(model):
+  records = _records(model, _fields(model))
+
+  if request.args.get('format', 'ndjson') == 'json':
+    def generate():
+      separator = '['
+      for record in records:
+        yield separator + json.dumps(record, default=_json_default)
+        separator = ',\n'
+      yield '[]\n' if separator == '[' else ']\n'
+    mimetype = 'application/json'
+  else:
+    def generate():
+      for record in records:
+        yield json.dumps(record, default=_json_default) + '\n'
+    mimetype = 'application/x-ndjson'
+
+  return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+@api.route('/venues')
+def venues():
+  return _stream(Venue)
+
+@api.route('/artists')
+def artists():
+  return _stream(Artist)
+
+@api.route('/shows')
+def shows():
+  return _stream(Show)
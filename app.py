@@ -3,7 +3,8 @@
 #----------------------------------------------------------------------------#
 
 import json
-from util import format_datetime
+from datetime import date, datetime, timedelta
+from util import format_datetime, encode_cursor, decode_cursor, parse_date, parse_month
 from flask import (
   Flask, 
   render_template, 
@@ -13,17 +14,33 @@ from flask import (
   redirect, 
   url_for, 
   jsonify, 
-  abort
+  abort,
+  make_response,
+  g
 )
-from models import db, Venue, Artist, Show
+from sqlalchemy import bindparam
+from models import db, Venue, Artist, Show, Genre, ArtistGenre, default_end_time
+from bookings import reserve, longest_show, BookingConflict
+import calendars
+from search import search_by_name, search_all, search_shows, SHOW_SEARCH_FILTERS
+from plans import check_plans
+from importer import import_data
+from benchmark import generate, bench
+from instrumentation import init_instrumentation, pool_status
+from config import engine_options
+from replicas import init_replicas
+from logs import init_logging
+from metrics import init_metrics
+from profiling import init_profiling
+import typeahead
+from cache import cache
+from conditional import conditional, entity_validators, listing_validators
+from api import api
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
-import logging
-from logging import Formatter, FileHandler
 from flask_wtf import Form
 from flask_migrate import Migrate
 from forms import *
-import sys
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -31,10 +48,25 @@ import sys
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
+app.config.from_envvar('FYYUR_SETTINGS', silent=True)
+# Heroku-style URLs use the scheme SQLAlchemy dropped
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):
+  app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://' + app.config['SQLALCHEMY_DATABASE_URI'][len('postgres://'):]
+app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+init_logging(app)
+init_profiling(app)
 db.init_app(app)
 migrate = Migrate(app, db)
-
-# TODO: connect to a local postgresql database
+init_metrics(app, db)
+app.cli.add_command(check_plans)
+app.cli.add_command(import_data)
+app.cli.add_command(generate)
+app.cli.add_command(bench)
+init_instrumentation(app)
+init_replicas(app)
+typeahead.init_typeahead(app)
+cache.init_app(app)
+app.register_blueprint(api)
 
 #----------------------------------------------------------------------------#
 # Filters.
@@ -51,35 +83,150 @@ def index():
   return render_template('pages/home.html')
 
 
+#  Search
+#  ----------------------------------------------------------------
+
+@app.route('/search', methods=['GET', 'POST'])
+def search():
+  term = request.values.get('search_term', '')
+  results = search_all(term, limit=app.config['SEARCH_RESULTS_LIMIT'],
+                       budget=app.config['SEARCH_TIME_BUDGET'])
+  return render_template('pages/search.html', results=results, search_term=term)
+
+
+@app.route('/autocomplete')
+def autocomplete():
+  kind = request.args.get('kind')
+  if kind is not None and kind not in typeahead.KINDS:
+    abort(400)
+  typeahead.index.ensure_fresh(app.config['TYPEAHEAD_REFRESH_INTERVAL'])
+  return jsonify(typeahead.index.lookup(request.args.get('q', ''), kind=kind,
+                                        limit=app.config['TYPEAHEAD_LIMIT']))
+
+
 #  Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@conditional(lambda: listing_validators(Venue, Show, rolls_over=True))
+@cache.cached(depends_on=('Venue', 'Show'), rolls_over=True)
 def venues():
-  unique_city_state = Venue.query.distinct(Venue.city, Venue.state).all()
+  page = request.args.get('page', 1, type=int)
+  genre = request.args.get('genre')
+  data, has_next = Venue._get_areas(page=max(page, 1), per_page=app.config['VENUE_AREAS_PER_PAGE'],
+                                    genre=genre)
+  app.logger.debug('venue areas', extra={'payload': data})
 
-  data = [x._get_venues_by_city_state for x in unique_city_state]
-  print("data: ",data)
-
-  return render_template('pages/venues.html', areas=data)
+  return render_template('pages/venues.html', areas=data, page=page, has_next=has_next, genre=genre)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   term = request.form.get('search_term', '')
-  search_result = Venue.query.filter(Venue.name.ilike('%'+ term +'%')).all()
+  search_result = search_by_name(Venue, term, limit=app.config['SEARCH_RESULTS_LIMIT'])
   response = {'count': len(search_result),
-              'data': [x._get_venues_by_search for x in search_result]
+              'data': search_result
             }
-  print("response: ", response)
+  app.logger.debug('venue search', extra={'payload': response})
   return render_template('pages/search_venues.html', results=response, search_term=term)
 
 @app.route('/venues/<int:venue_id>')
+@conditional(lambda venue_id: entity_validators(Venue, venue_id))
+@cache.cached(depends_on=('Venue', 'Artist', 'Show'), rolls_over=True)
 def show_venue(venue_id):
 
-  data = Venue.query.filter(Venue.id == venue_id)[0]._get_venue_with_show_info
-  print(data)
+  past_page = request.args.get('past_page', 1, type=int)
+  data = Venue.query.options(db.selectinload(Venue.genres)).get_or_404(venue_id)._get_venue_with_show_info(
+    past_page=past_page, past_per_page=app.config['PAST_SHOWS_PER_PAGE'])
+  app.logger.debug('venue page', extra={'payload': data})
   return render_template('pages/show_venue.html', venue=data)
 
+@app.route('/venues/<int:venue_id>/calendar')
+@conditional(lambda venue_id: _calendar_validators(Venue, venue_id))
+@cache.cached(depends_on=('Venue', 'Artist', 'Show'), vary=lambda: _calendar_period()[0])
+def venue_calendar(venue_id):
+  return _render_calendar(Venue.query.get_or_404(venue_id))
+
+@app.route('/venues/<int:venue_id>/calendar.ics')
+@conditional(lambda venue_id: _ical_validators(Venue, venue_id))
+def venue_ical(venue_id):
+  return _ical_response(Venue.query.get_or_404(venue_id))
+
+def _calendar_period():
+  # the (view, first day) a calendar page shows, and whether today's date
+  # picked it: malformed months and days fall back to the current ones by way
+  # of request.args.get(type=...)
+  if request.args.get('view') == 'week':
+    picked = request.args.get('day', type=parse_date)
+    day = picked or datetime.combine(date.today(), datetime.min.time())
+  else:
+    picked = request.args.get('month', type=parse_month)
+    day = picked or _this_month()
+  # the grid and its previous/next links must stay within datetime's years
+  if not datetime.min.year < day.year < datetime.max.year:
+    abort(400)
+  if request.args.get('view') == 'week':
+    return ('week', day - timedelta(days=day.weekday())), picked is None
+  return ('month', day), picked is None
+
+def _this_month():
+  return datetime.combine(date.today().replace(day=1), datetime.min.time())
+
+def _calendar_state(model, entity_id):
+  # the entity's ETag keys the month buckets too; set aside for the view
+  state, last_modified = entity_validators(model, entity_id)
+  g.calendar_state = state
+  return state, last_modified
+
+def _calendar_validators(model, entity_id):
+  (view, first), from_today = _calendar_period()
+  state, last_modified = _calendar_state(model, entity_id)
+  if state is None:
+    return None, None
+  # Last-Modified cannot tell that today's month or week has moved on; the ETag can
+  return '{}-{}-{:%Y%m%d}'.format(state, view, first), None if from_today else last_modified
+
+def _ical_validators(model, entity_id):
+  state, _ = _calendar_state(model, entity_id)
+  if state is None:
+    return None, None
+  return '{}-ics-{:%Y%m}'.format(state, _this_month()), None
+
+def _render_calendar(entity):
+  model = type(entity)
+  # flashes and profiling skip the validators
+  state = g.get('calendar_state') or entity_validators(model, entity.id)[0]
+  (view, first), _ = _calendar_period()
+  if view == 'week':
+    weeks = calendars.week_grid(model, entity.id, state, first)
+    first = weeks[0][0]['date']
+    previous, following = first - timedelta(days=7), first + timedelta(days=7)
+    nav = {'view': 'week', 'title': first,
+           'previous': {'view': 'week', 'day': previous.strftime('%Y-%m-%d')},
+           'next': {'view': 'week', 'day': following.strftime('%Y-%m-%d')}}
+  else:
+    weeks = calendars.month_grid(model, entity.id, state, first)
+    previous, following = (first - timedelta(days=1)).replace(day=1), (first + timedelta(days=32)).replace(day=1)
+    nav = {'view': 'month', 'title': first,
+           'previous': {'month': previous.strftime('%Y-%m')},
+           'next': {'month': following.strftime('%Y-%m')}}
+  return render_template('pages/calendar.html', entity=entity, kind=model.__name__.lower(),
+                         weeks=weeks, nav=nav, endpoint=request.endpoint)
+
+def _ical_response(entity):
+  model = type(entity)
+  state = g.get('calendar_state') or entity_validators(model, entity.id)[0]
+  start = _this_month()
+  end = start
+  for _ in range(app.config['CALENDAR_ICAL_MONTHS']):
+    end = (end + timedelta(days=32)).replace(day=1)
+  shows = calendars.shows_between(model, entity.id, start, end, state)
+  body = calendars.to_ical(shows, 'Fyyur: ' + entity.name, host=request.host)
+  response = make_response(body)
+  response.mimetype = 'text/calendar'
+  response.headers['Content-Disposition'] = 'attachment; filename="{}-{}.ics"'.format(
+    model.__name__.lower(), entity.id)
+  return response
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -95,7 +242,7 @@ def create_venue_submission():
   try:
     new_venue = Venue(
       name = venue_form.name.data,
-      genres = ",".join(venue_form.genres.data),
+      genres = Genre._get_or_create(venue_form.genres.data),
       address = venue_form.address.data,
       city = venue_form.city.data,
       state = venue_form.state.data,
@@ -110,7 +257,7 @@ def create_venue_submission():
   except:
     db.session.rollback()
     flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
-    print(sys.exc_info())
+    app.logger.exception('Could not create venue')
   finally:
     db.session.close()
 
@@ -138,36 +285,95 @@ def delete_venue(venue_id):
   # clicking that button delete it from the db then redirect the user to the homepage
   return jsonify({"success": True})
 
+@app.route('/venues', methods=['DELETE'])
+def delete_venues():
+  return _bulk_delete(Venue)
+
+def _bulk_delete(model):
+  # ids come as a JSON body {"ids": [...]} or as ?ids=1,2,3; one DELETE removes
+  # them all and ON DELETE CASCADE their shows and genre links, none of which
+  # are loaded into the session
+  payload = request.get_json(silent=True) or {}
+  ids = payload.get('ids') if isinstance(payload, dict) and 'ids' in payload else request.args.get('ids', '').split(',')
+  try:
+    ids = sorted({int(id) for id in ids if str(id).strip()})
+  except (TypeError, ValueError):
+    abort(400)
+  if not ids or len(ids) > app.config['BULK_DELETE_MAX_IDS']:
+    abort(400)
+
+  try:
+    deleted = db.session.execute(model.__table__.delete().where(model.id.in_(bindparam('ids', expanding=True))),
+                                 {'ids': ids}).rowcount
+    db.session.commit()
+  except:
+    db.session.rollback()
+    app.logger.exception('Could not delete %s rows', model.__tablename__)
+    abort(500)
+  finally:
+    db.session.close()
+
+  # a Core statement bypasses the session events that keep these in step
+  cache.invalidate({model.__name__, 'Show'})
+  kind = model.__name__.lower()
+  for id in ids:
+    typeahead.index.remove(kind, id)
+  return jsonify({'success': True, 'deleted': deleted})
+
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@conditional(lambda: listing_validators(Artist))
+@cache.cached(depends_on=('Artist',))
 def artists():
-  data = [x._get_artists_by_id_name for x in Artist.query.all()]
-  return render_template('pages/artists.html', artists=data)
+  genre = request.args.get('genre')
+  query = Artist.query
+  if genre:
+    query = query.filter(Artist.id.in_(Genre._members(ArtistGenre, genre)))
+  data = [x._get_artists_by_id_name for x in query.order_by(Artist.id)]
+  return render_template('pages/artists.html', artists=data, genre=genre)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   term = request.form.get('search_term', '')
-  search_result = Artist.query.filter(Artist.name.ilike('%'+ term +'%')).all()
+  search_result = search_by_name(Artist, term, limit=app.config['SEARCH_RESULTS_LIMIT'])
   response = {'count': len(search_result),
-              'data': [x._get_artists_by_search for x in search_result]
+              'data': search_result
             }
-  print("response: ", response)
+  app.logger.debug('artist search', extra={'payload': response})
   return render_template('pages/search_artists.html', results=response, search_term=term)
 
 @app.route('/artists/<int:artist_id>')
+@conditional(lambda artist_id: entity_validators(Artist, artist_id))
+@cache.cached(depends_on=('Venue', 'Artist', 'Show'), rolls_over=True)
 def show_artist(artist_id):
-  print("artist_id = ", artist_id)
-  data = Artist.query.filter(Artist.id == artist_id).one_or_none()._get_artist_with_show_info
-  print("data_artist_id: ", data)
+  past_page = request.args.get('past_page', 1, type=int)
+  data = Artist.query.options(db.selectinload(Artist.genres)).get_or_404(artist_id)._get_artist_with_show_info(
+    past_page=past_page, past_per_page=app.config['PAST_SHOWS_PER_PAGE'])
+  app.logger.debug('artist page', extra={'payload': data})
   return render_template('pages/show_artist.html', artist=data)
 
+@app.route('/artists/<int:artist_id>/calendar')
+@conditional(lambda artist_id: _calendar_validators(Artist, artist_id))
+@cache.cached(depends_on=('Venue', 'Artist', 'Show'), vary=lambda: _calendar_period()[0])
+def artist_calendar(artist_id):
+  return _render_calendar(Artist.query.get_or_404(artist_id))
+
+@app.route('/artists/<int:artist_id>/calendar.ics')
+@conditional(lambda artist_id: _ical_validators(Artist, artist_id))
+def artist_ical(artist_id):
+  return _ical_response(Artist.query.get_or_404(artist_id))
+
+@app.route('/artists', methods=['DELETE'])
+def delete_artists():
+  return _bulk_delete(Artist)
+
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   artist_form = ArtistForm()
-  artist_to_update = Artist.query.filter_by(id=artist_id).one_or_none()
+  artist_to_update = Artist.query.options(db.selectinload(Artist.genres)).filter_by(id=artist_id).one_or_none()
   if artist_to_update is None:
     abort(404)
 
@@ -182,7 +388,7 @@ def edit_artist_submission(artist_id):
   try:
     update_artist = Artist.query.filter(Artist.id==artist_id).one()
     update_artist.name = artist_form.name.data
-    update_artist.genres = ",".join(artist_form.genres.data)
+    update_artist._set_genres(artist_form.genres.data)
     update_artist.city = artist_form.city.data
     update_artist.state = artist_form.state.data
     update_artist.phone = artist_form.phone.data
@@ -194,7 +400,7 @@ def edit_artist_submission(artist_id):
   except:
     db.session.rollback()
     flash('An error occurred. Venue ' + request.form['name'] + ' could not be updated.')
-    print(sys.exc_info())
+    app.logger.exception('Could not update artist %s', artist_id)
   finally:
     db.session.close()
   return redirect(url_for('show_artist', artist_id=artist_id))
@@ -202,7 +408,7 @@ def edit_artist_submission(artist_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   venue_form = VenueForm()
-  venue_update = Venue.query.filter(Venue.id==venue_id).one_or_none()
+  venue_update = Venue.query.options(db.selectinload(Venue.genres)).filter(Venue.id==venue_id).one_or_none()
 
   if venue_update is None:
     abort(404)
@@ -220,7 +426,7 @@ def edit_venue_submission(venue_id):
     venue_to_update = Venue.query.filter(Venue.id==venue_id).one()
     venue_to_update.name = venue_form.name.data
     venue_to_update.address = venue_form.address.data
-    venue_to_update.genres = ",".join(venue_form.genres.data)
+    venue_to_update._set_genres(venue_form.genres.data)
     venue_to_update.city = venue_form.city.data
     venue_to_update.state = venue_form.state.data
     venue_to_update.phone = venue_form.phone.data
@@ -232,7 +438,7 @@ def edit_venue_submission(venue_id):
   except:
     db.session.rollback()
     flash('An error occurred. Venue ' + request.form['name'] + ' could not be updated.')
-    print(sys.exc_info())
+    app.logger.exception('Could not update venue %s', venue_id)
   finally:
     db.session.close()
   return redirect(url_for('show_venue', venue_id=venue_id))
@@ -252,7 +458,7 @@ def create_artist_submission():
   try:
     new_artist = Artist(
       name = artist_form.name.data,
-      genres = artist_form.genres.data,
+      genres = Genre._get_or_create(artist_form.genres.data),
       city = artist_form.city.data,
       state = artist_form.state.data,
       phone = artist_form.phone.data,
@@ -265,7 +471,7 @@ def create_artist_submission():
   except:
     flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('Could not create artist')
   finally:
     db.session.close()
 
@@ -275,9 +481,41 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@conditional(lambda: listing_validators(Venue, Artist, Show))
+@cache.cached(depends_on=('Venue', 'Artist', 'Show'))
 def shows():
-  data = [x._get_shows for x in Show.query.all()]
-  return render_template('pages/shows.html', shows=data)
+  # malformed cursors and dates are ignored by request.args.get(type=...)
+  after = request.args.get('after', type=decode_cursor)
+  start = request.args.get('from', type=parse_date)
+  end = request.args.get('to', type=parse_date)
+  limit = min(max(request.args.get('limit', app.config['SHOWS_PER_PAGE'], type=int), 1),
+              app.config['SHOWS_MAX_PER_PAGE'])
+
+  data, next_cursor = Show._get_shows_page(after=after, limit=limit, start=start, end=end)
+  next_url = None
+  if next_cursor is not None:
+    next_url = url_for('shows', after=encode_cursor(next_cursor), limit=limit,
+                       **{k: request.args[k] for k in ('from', 'to') if k in request.args})
+  return render_template('pages/shows.html', shows=data, next_url=next_url)
+
+@app.route('/shows/search')
+def search_shows_page():
+  filters = {k: request.args.get(k, '').strip() for k in SHOW_SEARCH_FILTERS}
+  after = request.args.get('after', type=decode_cursor)
+  start = request.args.get('from', type=parse_date)
+  end = request.args.get('to', type=parse_date)
+  limit = min(max(request.args.get('limit', app.config['SHOWS_PER_PAGE'], type=int), 1),
+              app.config['SHOWS_MAX_PER_PAGE'])
+
+  data, next_url = [], None
+  if any(filters.values()) or start or end:
+    data, next_cursor = search_shows({k: v for k, v in filters.items() if v},
+                                     after=after, limit=limit, start=start, end=end)
+    if next_cursor is not None:
+      args = {k: v for k, v in request.args.items() if v and k != 'after'}
+      next_url = url_for('search_shows_page', **dict(args, after=encode_cursor(next_cursor)))
+  return render_template('pages/show.html', shows=data, next_url=next_url, filters=filters,
+                         start=request.args.get('from', ''), end=request.args.get('to', ''))
 
 @app.route('/shows/create')
 def create_shows():
@@ -286,26 +524,62 @@ def create_shows():
 
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
-  new_show = ShowForm()
+  form = ShowForm()
 
   try:
-    new_show = Show(
-      artist_id = new_show.artist_id.data,
-      venue_id = new_show.venue_id.data,
-      start_time = new_show.start_time.data
-    )
-    db.session.add(new_show)
-    db.session.commit()
+    artist_id = int(form.artist_id.data)
+    venue_id = int(form.venue_id.data)
+    start_time = form.start_time.data
+    end_time = form.end_time.data or default_end_time(start_time)
+    if start_time is None or end_time <= start_time:
+      flash('The show must end after it starts.')
+      return render_template('forms/new_show.html', form=form), 400
+    if end_time - start_time > longest_show():
+      flash('A show can last at most {} hours.'.format(app.config['SHOW_MAX_DURATION'] // 60))
+      return render_template('forms/new_show.html', form=form), 400
+
+    with reserve(venue_id, artist_id, start_time, end_time):
+      new_show = Show(
+        artist_id = artist_id,
+        venue_id = venue_id,
+        start_time = start_time,
+        end_time = end_time
+      )
+      db.session.add(new_show)
+      db.session.commit()
     flash('Show was successfully listed!')
+  except BookingConflict as conflict:
+    db.session.rollback()
+    flash(str(conflict) + ' Pick another time.')
+    return render_template('forms/new_show.html', form=form), 409
   except:
     flash('An error occurred. Show could not be listed.')
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('Could not create show')
   finally:
     db.session.close()
 
   return render_template('pages/home.html')
 
+#  Health
+#  ----------------------------------------------------------------
+
+@app.route('/healthz')
+def healthz():
+  status = {'status': 'ok', 'pool': pool_status(db.engine)}
+  if 'logging' in app.extensions:
+    status['logging'] = app.extensions['logging'].status()
+  if typeahead.index.built:
+    status['typeahead'] = typeahead.index.memory_usage()
+  try:
+    db.session.execute('SELECT 1')
+    status['database'] = 'ok'
+  except Exception as e:
+    db.session.rollback()
+    status.update(status='error', database=str(e))
+    return jsonify(status), 503
+  return jsonify(status)
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -314,17 +588,6 @@ def not_found_error(error):
 def server_error(error):
     return render_template('errors/500.html'), 500
 
-
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
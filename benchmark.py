@@ -0,0 +1,280 @@
+import itertools
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from models import db, Venue, Artist, Show
+from forms import VenueForm
+from importer import import_rows
+from bookings import Timeline
+from instrumentation import count_queries
+from cache import cache
+
+#----------------------------------------------------------------------------#
+# Synthetic data.
+#----------------------------------------------------------------------------#
+
+AREAS = [('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('New York', 'NY'), ('Brooklyn', 'NY'),
+         ('Chicago', 'IL'), ('Austin', 'TX'), ('Houston', 'TX'), ('Seattle', 'WA'),
+         ('Portland', 'OR'), ('Denver', 'CO'), ('Nashville', 'TN'), ('New Orleans', 'LA'),
+         ('Atlanta', 'GA'), ('Miami', 'FL'), ('Boston', 'MA'), ('Philadelphia', 'PA'),
+         ('Detroit', 'MI'), ('Minneapolis', 'MN'), ('Phoenix', 'AZ'), ('Washington', 'DC')]
+ADJECTIVES = ['Velvet', 'Electric', 'Golden', 'Wild', 'Blue', 'Midnight', 'Rusty', 'Silver',
+              'Dueling', 'Crimson', 'Howling', 'Lucky', 'Broken', 'Neon', 'Hollow', 'Brass']
+NOUNS = ['Lounge', 'Hall', 'Room', 'Club', 'Stage', 'Garage', 'Tavern', 'Theater',
+         'Petals', 'Pianos', 'Foxes', 'Sax Band', 'Collective', 'Trio', 'Orchestra', 'Riders']
+
+
+def _genres(rng):
+  return rng.sample(list(dict(VenueForm.genres.kwargs['choices'])), rng.randint(1, 3))
+
+
+def _name(rng, i):
+  # the index keeps natural keys unique however many rows are generated
+  return 'The {} {} {}'.format(rng.choice(ADJECTIVES), rng.choice(NOUNS), i)
+
+
+def _zipf_weights(n, skew):
+  # a few venues and artists host most of the shows, like real catalogs
+  return [1.0 / (rank ** skew) for rank in range(1, n + 1)]
+
+
+def generate_venues(rng, count):
+  for i in range(count):
+    city, state = rng.choice(AREAS)
+    yield {'name': _name(rng, i), 'genres': _genres(rng), 'address': '{} Main Street'.format(i),
+           'city': city, 'state': state, 'phone': '555-{:03d}-{:04d}'.format(i % 1000, i % 10000),
+           'seeking_talent': rng.random() < 0.3, 'image_link': 'https://example.com/venues/{}.jpg'.format(i)}
+
+
+def generate_artists(rng, count):
+  for i in range(count):
+    city, state = rng.choice(AREAS)
+    yield {'name': _name(rng, i), 'genres': _genres(rng), 'city': city, 'state': state,
+           'phone': '555-{:03d}-{:04d}'.format(i % 1000, i % 10000),
+           'seeking_venue': rng.random() < 0.3, 'image_link': 'https://example.com/artists/{}.jpg'.format(i)}
+
+
+def generate_shows(rng, count, venue_ids, artist_ids, skew, span_days=730):
+  venue_ids, artist_ids = list(venue_ids), list(artist_ids)
+  rng.shuffle(venue_ids)
+  rng.shuffle(artist_ids)
+  venue_weights = _zipf_weights(len(venue_ids), skew)
+  artist_weights = _zipf_weights(len(artist_ids), skew)
+  now = datetime.now().replace(second=0, microsecond=0)
+  duration = timedelta(minutes=current_app.config['SHOW_DEFAULT_DURATION'])
+  # redraw double bookings; the busiest venues and artists fill up, so a few
+  # draws can be dropped and fewer than count shows come out
+  timelines = defaultdict(Timeline)
+  for _ in range(count):
+    for _ in range(10):
+      venue_id = rng.choices(venue_ids, venue_weights)[0]
+      artist_id = rng.choices(artist_ids, artist_weights)[0]
+      start_time = now + timedelta(minutes=rng.randint(-span_days, span_days) * 24 * 60 + rng.randint(0, 1439))
+      end_time = start_time + duration
+      venue, artist = timelines[('venue', venue_id)], timelines[('artist', artist_id)]
+      if venue.overlapping(start_time, end_time) is None and artist.overlapping(start_time, end_time) is None:
+        venue.add(start_time, end_time, None)
+        artist.add(start_time, end_time, None)
+        yield {'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time, 'end_time': end_time}
+        break
+
+
+@click.command('generate')
+@click.option('--venues', default=1000, show_default=True)
+@click.option('--artists', default=2000, show_default=True)
+@click.option('--shows', default=100000, show_default=True)
+@click.option('--skew', default=1.1, show_default=True, help='Zipf exponent of shows per venue/artist.')
+@click.option('--seed', default=42, show_default=True)
+@click.option('--create-tables', is_flag=True, help='Run db.create_all() first (e.g. for a fresh SQLite file).')
+@with_appcontext
+def generate(venues, artists, shows, skew, seed, create_tables):
+  """Fill the database with reproducible synthetic venues, artists and shows."""
+  rng = random.Random(seed)
+  if create_tables:
+    db.create_all()
+  for model, rows in ((Venue, generate_venues(rng, venues)), (Artist, generate_artists(rng, artists))):
+    stats = import_rows(model, rows)
+    click.echo('{}: {} inserted in {:.1f}s'.format(model.__tablename__, stats['inserted'], stats['seconds']))
+
+  venue_ids = [id for id, in db.session.query(Venue.id)]
+  artist_ids = [id for id, in db.session.query(Artist.id)]
+  stats = import_rows(Show, generate_shows(rng, shows, venue_ids, artist_ids, skew))
+  click.echo('Show: {} inserted in {:.1f}s'.format(stats['inserted'], stats['seconds']))
+
+#----------------------------------------------------------------------------#
+# Route benchmarks.
+#----------------------------------------------------------------------------#
+
+def _busiest(fk):
+  return db.session.query(fk).group_by(fk).order_by(db.func.count(Show.id).desc()).limit(1).scalar()
+
+
+def _form_data(entity):
+  # posting an entity's current values back measures the edit path without drifting the data
+  return {name: value for name, value in entity.serialize.items()
+          if name != 'id' and value is not None and value is not False}
+
+
+def _next_show_slots(venue_id, artist_id):
+  # every POST books a fresh slot after the last show, so none of them hit a conflict
+  start = (db.session.query(db.func.max(Show.end_time)).scalar() or datetime.now()) + timedelta(days=1)
+  slots = itertools.count()
+  def next_slot():
+    slot = start + timedelta(hours=3 * next(slots))
+    return {'venue_id': venue_id, 'artist_id': artist_id,
+            'start_time': slot.strftime('%Y-%m-%d %H:%M:%S'),
+            'end_time': (slot + timedelta(hours=2)).strftime('%Y-%m-%d %H:%M:%S')}
+  return next_slot
+
+
+def benchmark_requests(writes=False):
+  # data may be a callable, called for each request
+  venue_id = _busiest(Show.venue_id) or 1
+  artist_id = _busiest(Show.artist_id) or 1
+  month = datetime.now().strftime('%Y-%m')
+  requests = [
+    ('GET', '/', None),
+    ('GET', '/venues', None),
+    ('GET', '/artists', None),
+    ('GET', '/shows', None),
+    ('GET', '/shows?limit=500', None),
+    ('GET', '/venues/{}'.format(venue_id), None),
+    ('GET', '/artists/{}'.format(artist_id), None),
+    ('GET', '/venues/{}/calendar'.format(venue_id), None),
+    ('GET', '/venues/{}/calendar?view=week'.format(venue_id), None),
+    ('GET', '/artists/{}/calendar?month={}'.format(artist_id, month), None),
+    ('GET', '/venues/{}/calendar.ics'.format(venue_id), None),
+    ('GET', '/artists/{}/calendar.ics'.format(artist_id), None),
+    ('GET', '/venues/{}/edit'.format(venue_id), None),
+    ('GET', '/artists/{}/edit'.format(artist_id), None),
+    ('GET', '/shows/create', None),
+    ('GET', '/search?search_term=the', None),
+    ('GET', '/autocomplete?q=the', None),
+    ('GET', '/shows/search?venue=the', None),
+    ('GET', '/shows/search?state=CA&from={}-01'.format(month), None),
+    ('POST', '/venues/search', {'search_term': 'the'}),
+    ('POST', '/artists/search', {'search_term': 'the'}),
+    ('GET', '/api/v1/venues?fields=id,name', None),
+    ('GET', '/api/v1/artists', None),
+    ('GET', '/api/v1/shows', None),
+    ('GET', '/healthz', None),
+  ]
+  if writes:
+    venue_data, artist_data = (_form_data(entity) if entity else {}
+                               for entity in (Venue.query.get(venue_id), Artist.query.get(artist_id)))
+    requests += [
+      ('POST', '/venues/create', dict(venue_data, name='Benchmark Venue')),
+      ('POST', '/artists/create', dict(artist_data, name='Benchmark Artist')),
+      ('POST', '/venues/{}/edit'.format(venue_id), venue_data),
+      ('POST', '/artists/{}/edit'.format(artist_id), artist_data),
+      ('POST', '/shows/create', _next_show_slots(venue_id, artist_id)),
+    ]
+  return requests
+
+
+def _percentile(values, percent):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+
+def _request(client, method, url, data):
+  response = client.open(url, method=method, data=data() if callable(data) else data)
+  response.get_data()
+  return response
+
+
+def run_benchmark(app, iterations=20, warmup=2, memory_iterations=3, writes=False):
+  client = app.test_client()
+  results = {}
+  for method, url, data in benchmark_requests(writes=writes):
+    for _ in range(warmup):
+      _request(client, method, url, data)
+
+    latencies, queries, peaks = [], [], []
+    for _ in range(iterations):
+      form = data() if callable(data) else data
+      with count_queries() as stats:
+        started = time.perf_counter()
+        response = _request(client, method, url, form)
+        latencies.append((time.perf_counter() - started) * 1000)
+      queries.append(stats.count)
+
+    # tracemalloc slows allocation-heavy requests several times over, so
+    # memory is measured in runs of its own, never in the timed ones
+    for _ in range(memory_iterations):
+      form = data() if callable(data) else data
+      tracemalloc.start()
+      try:
+        _request(client, method, url, form)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024.0)
+      finally:
+        tracemalloc.stop()
+
+    results['{} {}'.format(method, url)] = {
+      'status': response.status_code,
+      'p50_ms': round(_percentile(latencies, 50), 3),
+      'p95_ms': round(_percentile(latencies, 95), 3),
+      'mean_ms': round(statistics.mean(latencies), 3),
+      'queries': max(queries),
+      'peak_kb': round(max(peaks), 1),
+    }
+  return results
+
+
+@click.command('bench')
+@click.option('--iterations', default=20, show_default=True)
+@click.option('--output', default=None, help='JSON file to write (default: bench_results/<timestamp>.json).')
+@click.option('--compare', 'baseline', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='Earlier results file to diff against.')
+@click.option('--memory-iterations', default=3, show_default=True, type=click.IntRange(min=1),
+              help='Untimed runs per route under tracemalloc, for peak memory.')
+@click.option('--with-cache', is_flag=True, help='Keep the page cache on (measures hits, not rendering).')
+@click.option('--writes', is_flag=True,
+              help='Also time the create and edit POSTs. They write to the configured database, '
+                   'so point DATABASE_URL at a scratch copy.')
+@with_appcontext
+def bench(iterations, output, baseline, memory_iterations, with_cache, writes):
+  """Drive every route through the test client and record latency, queries and memory."""
+  app = current_app._get_current_object()
+  backend = cache.backend
+  if not with_cache:
+    cache.backend = None
+  try:
+    routes = run_benchmark(app, iterations=iterations, memory_iterations=memory_iterations, writes=writes)
+  finally:
+    cache.backend = backend
+
+  report = {'timestamp': datetime.utcnow().isoformat(),
+            'database': db.engine.dialect.name,
+            'rows': {model.__tablename__: db.session.query(db.func.count(model.id)).scalar()
+                     for model in (Venue, Artist, Show)},
+            'iterations': iterations,
+            'page_cache': with_cache,
+            'writes': writes,
+            'routes': routes}
+
+  previous = {}
+  if baseline:
+    with open(baseline) as f:
+      previous = json.load(f)['routes']
+  for route, result in routes.items():
+    line = '{:<40} {:>4}  p50 {:>9.2f}ms  p95 {:>9.2f}ms  {:>4} queries  {:>9.1f}KB'.format(
+      route, result['status'], result['p50_ms'], result['p95_ms'], result['queries'], result['peak_kb'])
+    if route in previous:
+      line += '  (p50 {:+.1f}%)'.format(100.0 * (result['p50_ms'] - previous[route]['p50_ms']) / max(previous[route]['p50_ms'], 1e-9))
+    click.echo(line)
+
+  if output is None:
+    os.makedirs('bench_results', exist_ok=True)
+    output = os.path.join('bench_results', datetime.utcnow().strftime('%Y%m%dT%H%M%S') + '.json')
+  with open(output, 'w') as f:
+    json.dump(report, f, indent=2)
+  click.echo('Results written to ' + output)
@@ -0,0 +1,162 @@
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import timedelta
+from flask import current_app
+from sqlalchemy import DDL, event
+from sqlalchemy.exc import IntegrityError
+from models import db, Show
+from util import format_datetime
+
+#----------------------------------------------------------------------------#
+# Double-booking detection.
+#----------------------------------------------------------------------------#
+
+# A venue or artist cannot have two shows whose [start_time, end_time) ranges
+# overlap. Postgres enforces it with exclusion constraints over GiST indexes,
+# which also answer the pre-insert lookup. SQLite has no such constraint, so
+# the lookup runs inside a BEGIN IMMEDIATE transaction: the database-wide
+# write lock is held from the check to the commit of the new show, across
+# processes. Shows last at most SHOW_MAX_DURATION, so like Timeline the SQLite
+# lookup only reads the index range of shows starting that long before. Bulk
+# imports run the same lookup per row, under the same lock, per chunk.
+
+_EXCLUSION_CONSTRAINTS = {'venue': 'ex_Show_venue_overlap', 'artist': 'ex_Show_artist_overlap'}
+_COLUMNS = {'venue': Show.venue_id, 'artist': Show.artist_id}
+
+event.listen(db.metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+for kind, name in _EXCLUSION_CONSTRAINTS.items():
+  event.listen(Show.__table__, 'after_create', DDL(
+    'ALTER TABLE "Show" ADD CONSTRAINT "{}" EXCLUDE USING gist '
+    '({}_id WITH =, tsrange(start_time, end_time) WITH &&)'.format(name, kind)
+  ).execute_if(dialect='postgresql'))
+
+
+class BookingConflict(Exception):
+
+    def __init__(self, kind, id, show_id, start_time, end_time):
+      self.kind = kind
+      self.id = id
+      self.show_id = show_id
+      self.start_time = start_time
+      self.end_time = end_time
+      super(BookingConflict, self).__init__(
+        'The {} is already booked from {} to {} (show {}).'.format(
+          kind, format_datetime(start_time), format_datetime(end_time), show_id))
+
+
+class Timeline(object):
+    # shows of one venue or artist held in memory (the benchmark data
+    # generator), sorted by start; any show overlapping [start, end) starts
+    # after start - (longest show), so a lookup bisects to that window and
+    # only looks at the few shows inside it
+
+    def __init__(self, shows=()):
+      self._shows = sorted(shows)
+      self._starts = [start for start, _, _ in self._shows]
+      self._longest = max((end - start for start, end, _ in self._shows), default=timedelta(0))
+
+    def __len__(self):
+      return len(self._shows)
+
+    def overlapping(self, start, end):
+      i = bisect_right(self._starts, start - self._longest)
+      stop = bisect_left(self._starts, end)
+      for show in self._shows[i:stop]:
+        if show[1] > start:
+          return show
+      return None
+
+    def add(self, start, end, show_id):
+      i = bisect_right(self._starts, start)
+      self._starts.insert(i, start)
+      self._shows.insert(i, (start, end, show_id))
+      self._longest = max(self._longest, end - start)
+
+
+def longest_show():
+  return timedelta(minutes=current_app.config['SHOW_MAX_DURATION'])
+
+
+def _conflict_query(kind, id, start, end):
+  column = _COLUMNS[kind]
+  query = db.session.query(Show.id, Show.start_time, Show.end_time).filter(column == id)
+  if db.engine.dialect.name == 'postgresql':
+    # the form the exclusion constraint's GiST index can answer
+    return query.filter(db.func.tsrange(Show.start_time, Show.end_time).op('&&')(db.func.tsrange(start, end)))
+  # a range scan of (venue_id, start_time) / (artist_id, start_time), bounded
+  # below by the longest a show can last
+  return query.filter(Show.start_time > start - longest_show(), Show.start_time < end, Show.end_time > start)
+
+
+def _find_conflict_sql(kind, id, start, end):
+  return _conflict_query(kind, id, start, end).first()
+
+
+def find_conflict(venue_id, artist_id, start, end):
+  for kind, id in (('venue', venue_id), ('artist', artist_id)):
+    show = _find_conflict_sql(kind, id, start, end)
+    if show is not None:
+      show_id, start_time, end_time = show
+      return BookingConflict(kind, id, show_id, start_time, end_time)
+  return None
+
+
+def bulk_conflict_finder():
+  # find_conflict for many rows at once outside Postgres (the importer): the
+  # SQLite lookup is compiled once per kind, and the show a row rewrites
+  # (exclude_id) does not conflict with itself
+  connection = db.session.connection(mapper=Show.__mapper__).execution_options(compiled_cache={})
+  statements = {kind: db.select([Show.id, Show.start_time, Show.end_time])
+                         .where(db.and_(column == db.bindparam('id'), Show.id != db.bindparam('exclude_id'),
+                                        Show.start_time > db.bindparam('floor'), Show.start_time < db.bindparam('end'),
+                                        Show.end_time > db.bindparam('start')))
+                         .limit(1)
+                for kind, column in _COLUMNS.items()}
+  longest = longest_show()
+
+  def find(venue_id, artist_id, start, end, exclude_id=None):
+    for kind, id in (('venue', venue_id), ('artist', artist_id)):
+      show = connection.execute(statements[kind], id=id, exclude_id=-1 if exclude_id is None else exclude_id,
+                                floor=start - longest, end=end, start=start).first()
+      if show is not None:
+        show_id, start_time, end_time = show
+        return BookingConflict(kind, id, show_id, start_time, end_time)
+    return None
+  return find
+
+
+def begin_immediate():
+  # take SQLite's write lock before the check, so that no other process or
+  # worker can commit a show between the check and our insert. pysqlite only
+  # opens a transaction itself before DML, and then already holds the lock.
+  connection = db.session.connection(mapper=Show.__mapper__)
+  if not connection.connection.in_transaction:
+    connection.execute('BEGIN IMMEDIATE')
+
+
+@contextmanager
+def reserve(venue_id, artist_id, start, end):
+  """Raise BookingConflict if the slot is taken, else run the block that creates the show."""
+  if db.engine.dialect.name == 'sqlite':
+    begin_immediate()
+    conflict = find_conflict(venue_id, artist_id, start, end)
+    if conflict is not None:
+      raise conflict
+    yield
+    return
+
+  conflict = find_conflict(venue_id, artist_id, start, end)
+  if conflict is not None:
+    raise conflict
+  try:
+    yield
+  except IntegrityError as e:
+    # a concurrent booking won the race; report it like the pre-check would
+    if getattr(e.orig, 'pgcode', None) != '23P01':
+      raise
+    db.session.rollback()
+    conflict = find_conflict(venue_id, artist_id, start, end)
+    if conflict is None:
+      raise
+    raise conflict
@@ -0,0 +1,207 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+from flask import g, request, session
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, Venue, Artist, Show
+from metrics import cache_requests
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+# Rendered pages are keyed by endpoint, view arguments, query string and the
+# current version of every model the page reads. A commit touching a model
+# bumps its version, so stale pages are never looked up again and age out
+# through LRU/TTL eviction.
+
+class MemoryCache(object):
+    # per-process: other workers only see an invalidation once their copy expires
+
+    def __init__(self, max_entries=1024, default_ttl=300):
+      self.max_entries = max_entries
+      self.default_ttl = default_ttl
+      self._entries = OrderedDict()
+      self._versions = {}
+      self._lock = threading.Lock()
+
+    def get(self, key):
+      with self._lock:
+        entry = self._entries.get(key)
+        if entry is None:
+          return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+          del self._entries[key]
+          return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+      expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+      with self._lock:
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+          self._entries.popitem(last=False)
+
+    def versions(self, tags):
+      with self._lock:
+        return [self._versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+      with self._lock:
+        for tag in tags:
+          self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def clear(self):
+      with self._lock:
+        self._entries.clear()
+
+
+class RedisCache(object):
+    # shared by every worker; LRU eviction is the server's maxmemory-policy (allkeys-lru)
+
+    def __init__(self, url, default_ttl=300, prefix='fyyur:'):
+      import redis
+      self.default_ttl = default_ttl
+      self.prefix = prefix
+      self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+      value = self._redis.get(self.prefix + key)
+      return None if value is None else value.decode('utf-8')
+
+    def set(self, key, value, ttl=None):
+      ttl = self.default_ttl if ttl is None else ttl
+      self._redis.setex(self.prefix + key, max(int(ttl), 1), value)
+
+    def versions(self, tags):
+      return [int(version or 0) for version in self._redis.mget([self.prefix + 'version:' + tag for tag in tags])]
+
+    def bump(self, tags):
+      pipeline = self._redis.pipeline()
+      for tag in tags:
+        pipeline.incr(self.prefix + 'version:' + tag)
+      pipeline.execute()
+
+    def clear(self):
+      for pattern in ('page:*', 'data:*'):
+        for key in self._redis.scan_iter(self.prefix + pattern):
+          self._redis.delete(key)
+
+
+class PageCache(object):
+
+    def __init__(self, app=None):
+      self.backend = None
+      if app is not None:
+        self.init_app(app)
+
+    def init_app(self, app):
+      if not app.config.get('CACHE_ENABLED', True):
+        return
+      if app.config['CACHE_BACKEND'] == 'redis':
+        self.backend = RedisCache(app.config['CACHE_REDIS_URL'], default_ttl=app.config['CACHE_DEFAULT_TTL'])
+      else:
+        self.backend = MemoryCache(max_entries=app.config['CACHE_MAX_ENTRIES'],
+                                   default_ttl=app.config['CACHE_DEFAULT_TTL'])
+      app.extensions['page_cache'] = self
+
+    def invalidate(self, tags):
+      if self.backend is not None and tags:
+        self.backend.bump(sorted(tags))
+
+    def cached(self, depends_on, rolls_over=False, vary=None):
+      # rolls_over: the page splits shows into past/upcoming, so an entry must
+      # not outlive the next show start; vary: returns whatever else, besides
+      # the request, the page depends on (e.g. today's date)
+      def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+          # pages carrying flashed messages are one-off renders, and a client
+          # reading its own writes must not get a page rendered from a lagging replica;
+          # a profiled request has to render
+          if self.backend is None or request.method != 'GET' or session.get('_flashes') \
+              or g.get('read_your_writes') or g.get('profiling'):
+            return view(*args, **kwargs)
+
+          versions = '.'.join(str(v) for v in self.backend.versions(depends_on))
+          # a body cached by this process may be older than another worker's
+          # commit, or come from a lagging replica; keying on the ETag the
+          # conditional view just computed keeps them from going out under it
+          key = 'page:{}:{}:{}:{}:{}:{}'.format(request.endpoint, sorted(request.view_args.items()),
+                                                sorted(request.args.items(multi=True)), versions, g.get('etag'),
+                                                vary() if vary is not None else None)
+          page = self.backend.get(key)
+          cache_requests.labels('page', 'miss' if page is None else 'hit').inc()
+          if page is not None:
+            return page
+
+          page = view(*args, **kwargs)
+          if isinstance(page, str):
+            self.backend.set(key, page, ttl=self._ttl(rolls_over))
+          return page
+        return wrapper
+      return decorator
+
+    def memoize_many(self, names, depends_on, compute, ttl=None):
+      # JSON-serializable values computed from the database, keyed and
+      # invalidated like pages; compute(missing) returns {name: value} for
+      # every name not cached, so misses can be filled by a single query
+      if self.backend is None or g.get('read_your_writes'):
+        return compute(names)
+
+      versions = '.'.join(str(v) for v in self.backend.versions(depends_on))
+      keys = {name: 'data:{}:{}'.format(name, versions) for name in names}
+      values = {}
+      for name, key in keys.items():
+        value = self.backend.get(key)
+        if value is not None:
+          values[name] = json.loads(value)
+
+      missing = [name for name in names if name not in values]
+      cache_requests.labels('data', 'hit').inc(len(values))
+      cache_requests.labels('data', 'miss').inc(len(missing))
+      if missing:
+        computed = compute(missing)
+        for name in missing:
+          self.backend.set(keys[name], json.dumps(computed[name]), ttl=ttl)
+        values.update(computed)
+      return values
+
+    def _ttl(self, rolls_over):
+      ttl = self.backend.default_ttl
+      if rolls_over:
+        now = datetime.now()
+        next_start = db.session.query(db.func.min(Show.start_time)).filter(Show.start_time > now).scalar()
+        if next_start is not None:
+          ttl = min(ttl, (next_start - now).total_seconds())
+      return ttl
+
+
+cache = PageCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_models(session, flush_context):
+  changed = session.info.setdefault('changed_models', set())
+  for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+    changed.add(type(obj).__name__)
+  if any(isinstance(obj, (Venue, Artist)) for obj in session.deleted):
+    # their shows go with them through ON DELETE CASCADE
+    changed.add('Show')
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_models(session):
+  cache.invalidate(session.info.pop('changed_models', None))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_models(session):
+  session.info.pop('changed_models', None)
@@ -0,0 +1,134 @@
+import calendar
+from collections import defaultdict
+from datetime import datetime, timedelta
+from models import db, Venue, Artist, Show
+from cache import cache
+
+#----------------------------------------------------------------------------#
+# Venue and artist calendars.
+#----------------------------------------------------------------------------#
+
+# Calendars are read in month buckets memoized in the page cache, so month
+# and week grids and the iCalendar feed share them. The months missing from
+# the cache are filled by one range query on (venue_id, start_time) or
+# (artist_id, start_time). Buckets are keyed on the entity's state as read
+# from the database (its ETag), since the cache's own version counters only
+# see writes made by this process.
+
+_COLUMNS = {Venue: Show.venue_id, Artist: Show.artist_id}
+_DEPENDS_ON = ('Venue', 'Artist', 'Show')
+
+
+def _next_month(month):
+  return (month + timedelta(days=32)).replace(day=1)
+
+
+def _range_query(model, id, start, end):
+  return db.session.query(Show.id, Show.start_time, Show.end_time, Show.venue_id, Venue.name,
+                          Show.artist_id, Artist.name) \
+    .join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id) \
+    .filter(_COLUMNS[model] == id, Show.start_time >= start, Show.start_time < end) \
+    .order_by(Show.start_time, Show.id)
+
+
+def _bucket_name(model, id, state, month):
+  return 'calendar:{}:{}:{}:{:%Y-%m}'.format(model.__name__, id, state, month)
+
+
+def _load_buckets(model, id, state, months):
+  buckets = {_bucket_name(model, id, state, month): [] for month in months}
+  for show_id, start_time, end_time, venue_id, venue_name, artist_id, artist_name \
+      in _range_query(model, id, min(months), _next_month(max(months))):
+    bucket = buckets.get(_bucket_name(model, id, state, start_time))
+    if bucket is not None:
+      bucket.append({'id': show_id,
+                     'start_time': start_time.isoformat(),
+                     'end_time': end_time.isoformat() if end_time else None,
+                     'venue_id': venue_id,
+                     'venue_name': venue_name,
+                     'artist_id': artist_id,
+                     'artist_name': artist_name})
+  return buckets
+
+
+def shows_between(model, id, start, end, state):
+  months = []
+  month = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+  while month < end:
+    months.append(month)
+    month = _next_month(month)
+
+  names = {_bucket_name(model, id, state, month): month for month in months}
+  buckets = cache.memoize_many(list(names), _DEPENDS_ON,
+                               lambda missing: _load_buckets(model, id, state, [names[name] for name in missing]))
+  shows = []
+  for name in names:
+    for show in buckets[name]:
+      start_time = datetime.fromisoformat(show['start_time'])
+      if start <= start_time < end:
+        shows.append(dict(show, start_time=start_time,
+                          end_time=show['end_time'] and datetime.fromisoformat(show['end_time'])))
+  return shows
+
+
+def _grid(model, id, state, weeks, month=None):
+  start = datetime.combine(weeks[0][0], datetime.min.time())
+  end = datetime.combine(weeks[-1][-1], datetime.min.time()) + timedelta(days=1)
+  by_day = defaultdict(list)
+  for show in shows_between(model, id, start, end, state):
+    by_day[show['start_time'].date()].append(show)
+  return [[{'date': datetime.combine(day, datetime.min.time()),
+            'in_range': month is None or day.month == month,
+            'shows': by_day[day]}
+           for day in week]
+          for week in weeks]
+
+
+def month_grid(model, id, state, month):
+  weeks = calendar.Calendar().monthdatescalendar(month.year, month.month)
+  return _grid(model, id, state, weeks, month=month.month)
+
+
+def week_grid(model, id, state, day):
+  first = day.date() - timedelta(days=day.weekday())
+  return _grid(model, id, state, [[first + timedelta(days=i) for i in range(7)]])
+
+#----------------------------------------------------------------------------#
+# iCalendar export.
+#----------------------------------------------------------------------------#
+
+def _ical_text(value):
+  return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+  # content lines are limited to 75 octets; continuations start with a space
+  parts, part, size = [], '', 0
+  for char in line:
+    width = len(char.encode('utf-8'))
+    if size + width > 75:
+      parts.append(part)
+      part, size = ' ', 1
+    part += char
+    size += width
+  parts.append(part)
+  return '\r\n'.join(parts)
+
+
+def to_ical(shows, name, host='fyyur'):
+  stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+  lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//Fyyur//Calendar//EN',
+           'CALSCALE:GREGORIAN', 'X-WR-CALNAME:' + _ical_text(name)]
+  for show in shows:
+    # show times are stored without a zone, so they are exported as floating local times
+    lines.extend(['BEGIN:VEVENT',
+                  'UID:show-{}@{}'.format(show['id'], host),
+                  'DTSTAMP:' + stamp,
+                  'DTSTART:' + show['start_time'].strftime('%Y%m%dT%H%M%S')])
+    if show['end_time']:
+      lines.append('DTEND:' + show['end_time'].strftime('%Y%m%dT%H%M%S'))
+    lines.extend(['SUMMARY:' + _ical_text('{} at {}'.format(show['artist_name'], show['venue_name'])),
+                  'END:VEVENT'])
+  lines.append('END:VCALENDAR')
+  return '\r\n'.join(_fold(line) for line in lines) + '\r\n'
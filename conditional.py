@@ -0,0 +1,103 @@
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+from flask import g, make_response, request, session
+from models import db, Venue, Artist, Show, TableVersion
+
+#----------------------------------------------------------------------------#
+# Conditional GET.
+#----------------------------------------------------------------------------#
+
+# Validators come from cheap reads (row versions, table versions, aggregates
+# over one entity's shows) and are checked before the view runs, so a matching
+# If-None-Match or If-Modified-Since is answered with a 304 without building
+# the page.
+
+_SHOW_FOREIGN_KEYS = {Venue: (Show.venue_id, Artist, Show.artist_id),
+                      Artist: (Show.artist_id, Venue, Show.venue_id)}
+
+
+def _utc(value):
+  # start_time is stored as local time, updated_at as UTC
+  return value.astimezone(timezone.utc).replace(tzinfo=None) if value is not None else None
+
+
+def _last_passed_start(criterion=None):
+  # when the last show started is when the past/upcoming split last changed
+  query = db.session.query(db.func.max(Show.start_time)).filter(Show.start_time <= datetime.now())
+  if criterion is not None:
+    query = query.filter(criterion)
+  return _utc(query.scalar())
+
+
+def entity_validators(model, entity_id, *state):
+  # state: anything else the page depends on, hashed into the ETag
+  show_fk, counterpart, counterpart_fk = _SHOW_FOREIGN_KEYS[model]
+  row = db.session.query(model.version, model.updated_at,
+                         db.func.count(Show.id), db.func.max(Show.updated_at),
+                         db.func.max(counterpart.updated_at)) \
+    .outerjoin(Show, show_fk == model.id) \
+    .outerjoin(counterpart, counterpart.id == counterpart_fk) \
+    .filter(model.id == entity_id) \
+    .group_by(model.id, model.version, model.updated_at) \
+    .one_or_none()
+  if row is None:
+    return None, None
+
+  last_passed = _last_passed_start(show_fk == entity_id)
+  last_modified = max(x for x in (row[1], row[3], row[4], last_passed) if x is not None)
+  return _etag(model.__name__, entity_id, *row, last_passed, *state), last_modified
+
+
+def listing_validators(*models, rolls_over=False):
+  # the trigger-maintained TableVersion rows, not an O(rows) scan of each table
+  state = TableVersion._get_versions(*(model.__tablename__ for model in models))
+  if len(state) != len(models):
+    # a TableVersion table without its seed rows cannot validate anything
+    return None, None
+  modified = [updated_at for _, _, updated_at in state]
+  if rolls_over:
+    state.append(_last_passed_start())
+    modified.append(state[-1])
+  modified = [x for x in modified if x is not None]
+  return _etag(*state), max(modified) if modified else None
+
+
+def _etag(*state):
+  return hashlib.md5(repr(state).encode('utf-8')).hexdigest()
+
+
+def _not_modified(etag, last_modified):
+  if request.if_none_match:
+    return request.if_none_match.contains_weak(etag)
+  if request.if_modified_since and last_modified is not None:
+    # Last-Modified has one-second resolution
+    return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+  return False
+
+
+def conditional(validators):
+  def decorator(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      # pages carrying flashed messages are one-off renders, and a profiled request has to render
+      if request.method != 'GET' or session.get('_flashes') or g.get('profiling'):
+        return view(*args, **kwargs)
+
+      etag, last_modified = validators(**kwargs)
+      if etag is None:
+        return view(*args, **kwargs)
+      # the page cache keys on it, so the body sent always matches the ETag
+      g.etag = etag
+
+      if _not_modified(etag, last_modified):
+        response = make_response('', 304)
+      else:
+        response = make_response(view(*args, **kwargs))
+      response.set_etag(etag)
+      if last_modified is not None:
+        response.last_modified = last_modified
+      response.cache_control.no_cache = True
+      return response
+    return wrapper
+  return decorator
@@ -1,5 +1,10 @@
 import os
-SECRET_KEY = os.urandom(32)
+# Every worker must share one key or sessions/flashes break behind a load
+# balancer; the random fallback is only fit for a single local process.
+# Profiling tokens are signed with it too, so `flask profile-token` refuses
+# to run until SECRET_KEY is set (here, in the environment or FYYUR_SETTINGS).
+fallback_secret_key = os.urandom(32)
+SECRET_KEY = os.environ.get('SECRET_KEY') or fallback_secret_key
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -7,8 +12,118 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 DEBUG = True
 
 # Connect to the database
+# Any setting below can also be overridden from a python file named by the
+# FYYUR_SETTINGS environment variable. Use e.g. DATABASE_URL=sqlite:///fyyur.db
+# for local runs without Postgres.
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://student@localhost:5432/project1')
+SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Read replicas, as a comma-separated DATABASE_REPLICA_URLS: GET requests read
+# from one of them, writes and the requests right after a write (within
+# REPLICA_LAG_WINDOW seconds) use the primary
+SQLALCHEMY_BINDS = {'replica_{}'.format(i): url.strip()
+                    for i, url in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split(','))
+                    if url.strip()}
+SQLALCHEMY_READ_REPLICAS = sorted(SQLALCHEMY_BINDS)
+REPLICA_LAG_WINDOW = int(os.environ.get('REPLICA_LAG_WINDOW', 5))
 
-# TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgresql://student@localhost:5432/project1'
-SQLALCHEMY_TRACK_MODIFICATIONS = False
+# Connection pool, per worker process: size workers so that
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays under max_connections
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'yes')
+# Postgres statement_timeout in milliseconds, 0 disables it
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+
+
+def engine_options(settings):
+  url = settings['SQLALCHEMY_DATABASE_URI']
+  if url.startswith('sqlite'):
+    # SQLite connections are not pooled by size
+    return {}
+
+  options = {'pool_size': settings['DB_POOL_SIZE'],
+             'max_overflow': settings['DB_MAX_OVERFLOW'],
+             'pool_timeout': settings['DB_POOL_TIMEOUT'],
+             'pool_recycle': settings['DB_POOL_RECYCLE'],
+             'pool_pre_ping': settings['DB_POOL_PRE_PING']}
+  if url.startswith('postgres') and settings['DB_STATEMENT_TIMEOUT']:
+    options['connect_args'] = {'options': '-c statement_timeout={}'.format(settings['DB_STATEMENT_TIMEOUT'])}
+  return options
+
+# Number of city/state groups rendered per page of /venues
+VENUE_AREAS_PER_PAGE = 100
+
+# Past shows rendered per page on venue and artist detail pages
+PAST_SHOWS_PER_PAGE = 30
+
+# Keyset page size for /shows (?limit= is clamped to the max)
+SHOWS_PER_PAGE = 60
+SHOWS_MAX_PER_PAGE = 500
+
+# Length in minutes of a show listed without an end time
+SHOW_DEFAULT_DURATION = 180
+# Longest show in minutes; the SQLite double-booking check looks no further back
+SHOW_MAX_DURATION = 24 * 60
+
+# Months of shows, from the current one, in the iCalendar feeds
+CALENDAR_ICAL_MONTHS = 12
+
+# Most ids accepted by one DELETE /venues or /artists request
+BULK_DELETE_MAX_IDS = 10000
+
+# Maximum number of ranked results returned by venue/artist search
+SEARCH_RESULTS_LIMIT = 50
+# Unified /search: threads shared by the venue/artist/show sub-searches, and the
+# seconds to wait for them before rendering whatever has come back
+SEARCH_WORKERS = 8
+SEARCH_TIME_BUDGET = 0.5
+
+# In-process name index behind /autocomplete, built when a worker starts serving
+TYPEAHEAD_PRELOAD = True
+TYPEAHEAD_LIMIT = 10
+# Seconds between checks for names written by other workers or imports
+TYPEAHEAD_REFRESH_INTERVAL = 5
+
+# Logging: JSON lines written by a background thread to LOG_FILE (rotated) or
+# stderr. DEBUG records, which carry page payloads, are kept at the sample
+# rate and at most LOG_DEBUG_RATE_LIMIT a second per message (0: no limit).
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_ROOT_LEVEL = os.environ.get('LOG_ROOT_LEVEL', 'INFO')
+# per logger overrides, e.g. {'sqlalchemy.engine': 'INFO'}
+LOG_LEVELS = {}
+LOG_JSON = os.environ.get('LOG_JSON', '1').lower() in ('1', 'true', 'yes')
+LOG_FILE = os.environ.get('LOG_FILE')
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.1))
+LOG_DEBUG_RATE_LIMIT = int(os.environ.get('LOG_DEBUG_RATE_LIMIT', 10))
+
+# Prometheus text format at /metrics: per-route request counts, latency, response
+# size and DB time, page cache hits and pool usage. Behind gunicorn, workers are
+# aggregated through PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py).
+METRICS_ENABLED = True
+
+# Requests sent with a token from `flask profile-token` run under cProfile; the
+# newest PROFILE_KEEP profiles are kept in PROFILE_DIR and listed at /admin/profiles
+PROFILING_ENABLED = True
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(basedir, 'profiles'))
+PROFILE_KEEP = 50
+PROFILE_TOKEN_MAX_AGE = 24 * 60 * 60
+
+# Per-request query count/DB time headers, and N+1 warnings in debug mode
+SQL_INSTRUMENTATION = True
+SQL_N_PLUS_ONE_THRESHOLD = 5
+
+# Rendered page cache: 'memory' (per process, LRU) or 'redis' (shared, needs the redis package).
+# `flask import` against a database that running servers use requires 'redis'.
+CACHE_ENABLED = True
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_MAX_ENTRIES = 1024
+CACHE_DEFAULT_TTL = 300
+
+# Rows fetched per round trip by the streaming /api/v1 endpoints
+API_STREAM_BATCH_SIZE = 1000
@@ -0,0 +1,20 @@
+# gunicorn app:app -c gunicorn.conf.py
+import os
+import shutil
+import tempfile
+
+# Workers write their metrics here so that /metrics can sum them; it must be
+# set before the app (and prometheus_client) is imported
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'fyyur-metrics'))
+
+
+def on_starting(server):
+  # samples of a previous run would be added to this one's
+  path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+  shutil.rmtree(path, ignore_errors=True)
+  os.makedirs(path)
+
+
+def child_exit(server, worker):
+  from prometheus_client import multiprocess
+  multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,349 @@
+import csv
+import io
+import json
+import time
+import click
+import dateutil.parser
+from datetime import datetime
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam
+from collections import defaultdict
+from models import db, Venue, Artist, Show, Genre, VenueGenre, ArtistGenre, default_end_time
+from bookings import Timeline, begin_immediate, bulk_conflict_finder, longest_show
+from cache import cache, MemoryCache
+import typeahead
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#----------------------------------------------------------------------------#
+
+# Rows are upserted on natural keys in chunks, one commit per chunk. Postgres
+# loads each chunk with COPY into a temp table and merges it with one UPDATE
+# and one INSERT; other databases fall back to executemany. Only rows whose
+# values differ are updated, so re-importing a file leaves versions, ETags and
+# cached pages alone. Shows that would double-book a venue or artist are
+# rejected: by the exclusion constraints on Postgres, and elsewhere by the
+# booking lookup run per row under the chunk's write lock.
+
+# the first column of each key is the one looked up in the database, the rest
+# are matched in Python
+NATURAL_KEYS = {Venue: ('name', 'city', 'state'),
+                Artist: ('name', 'city', 'state'),
+                Show: ('start_time', 'venue_id', 'artist_id')}
+
+# columns managed by the database / mapper, never taken from input files
+_MANAGED_COLUMNS = ('id', 'version', 'updated_at')
+
+_GENRE_LINKS = {Venue: (VenueGenre, 'venue_id'), Artist: (ArtistGenre, 'artist_id')}
+
+
+def read_rows(path):
+  extension = path.rsplit('.', 1)[-1].lower()
+  with open(path, newline='', encoding='utf-8') as f:
+    if extension == 'csv':
+      yield from csv.DictReader(f)
+    elif extension in ('ndjson', 'jsonl'):
+      for line in f:
+        if line.strip():
+          yield json.loads(line)
+    elif extension == 'json':
+      yield from json.load(f)
+    else:
+      raise click.BadParameter('{}: expected a .csv, .json or .ndjson file'.format(path))
+
+
+def _parse_datetime(value):
+  try:
+    return datetime.fromisoformat(value)
+  except ValueError:
+    return dateutil.parser.parse(value)
+
+
+def _chunks(rows, size):
+  chunk = []
+  for row in rows:
+    chunk.append(row)
+    if len(chunk) >= size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+class _NameResolver(object):
+    # shows reference venues and artists by id or by name; a name shared by
+    # several rows resolves to the oldest one
+
+    def __init__(self):
+      self._ids = {}
+
+    def __call__(self, model, name):
+      if model not in self._ids:
+        self._ids[model] = dict(db.session.query(model.name, model.id).order_by(model.id.desc()))
+      return self._ids[model].get(name)
+
+
+def _parse_genres(value):
+  # lists, comma-joined strings, and the "{a,b}" / "['a', 'b']" text a list
+  # written into the old string column came out as
+  if isinstance(value, str):
+    value = value.strip().strip('{}[]').split(',')
+  names = [name.strip().strip('"\'').strip() for name in value or ()]
+  return [name for name in names if name]
+
+
+def _coerce(model, row, resolve):
+  values = {}
+  for column in model.__table__.columns:
+    if column.name in _MANAGED_COLUMNS or column.name not in row:
+      continue
+    value = row[column.name]
+    if value == '':
+      value = None
+    elif isinstance(value, list):
+      value = ','.join(value)
+    elif isinstance(value, str):
+      if isinstance(column.type, db.Boolean):
+        value = value.strip().lower() in ('1', 't', 'true', 'y', 'yes')
+      elif isinstance(column.type, db.DateTime):
+        value = _parse_datetime(value)
+      elif isinstance(column.type, db.Integer):
+        value = int(value)
+    values[column.name] = value
+
+  if model is Show:
+    for fk, counterpart in (('venue_id', Venue), ('artist_id', Artist)):
+      name = row.get(fk.replace('_id', '_name'))
+      if values.get(fk) is None and name:
+        values[fk] = resolve(counterpart, name)
+
+  if any(values.get(key) is None for key in NATURAL_KEYS[model]):
+    return None
+  if model is Show and values.get('end_time') is None:
+    # COPY skips column defaults, so fill this one in here
+    values['end_time'] = default_end_time(values['start_time'])
+  if model is Show and not values['start_time'] < values['end_time'] <= values['start_time'] + longest_show():
+    return None
+  return values
+
+
+def _group_by_columns(rows):
+  groups = {}
+  for row in rows:
+    groups.setdefault(tuple(sorted(row)), []).append(row)
+  return groups.items()
+
+
+def _existing_rows(model, rows, columns=()):
+  # natural key -> (id, *columns) for the rows already in the database
+  table = model.__table__
+  keys = NATURAL_KEYS[model]
+  key_columns = [table.c[key] for key in keys]
+  candidates = db.session.query(*key_columns, table.c.id, *[table.c[column] for column in columns]) \
+    .filter(key_columns[0].in_(bindparam('lookup', expanding=True))) \
+    .params(lookup=list({row[keys[0]] for row in rows}))
+  return {tuple(row[:len(keys)]): tuple(row[len(keys):]) for row in candidates}
+
+
+def _existing_ids(model, rows):
+  return {key: row[0] for key, row in _existing_rows(model, rows).items()}
+
+
+def _upsert_executemany(model, columns, rows):
+  table = model.__table__
+  keys = NATURAL_KEYS[model]
+  existing = _existing_rows(model, rows, columns)
+
+  inserts, updates = [], []
+  for row in rows:
+    match = existing.get(tuple(row[key] for key in keys))
+    if match is None:
+      inserts.append(dict(row, version=1))
+    elif match[1:] != tuple(row[column] for column in columns):
+      updates.append(dict({'v_' + column: row[column] for column in columns}, row_id=match[0]))
+
+  if inserts:
+    db.session.execute(table.insert(), inserts)
+  if updates:
+    statement = table.update() \
+      .where(table.c.id == bindparam('row_id')) \
+      .values(version=table.c.version + 1, **{column: bindparam('v_' + column) for column in columns})
+    db.session.execute(statement, updates)
+  return len(inserts), len(updates)
+
+
+def _upsert_copy(model, columns, rows):
+  table = '"{}"'.format(model.__tablename__)
+  names = ', '.join('"{}"'.format(column) for column in columns)
+  matches = ' AND '.join('t."{0}" = s."{0}"'.format(key) for key in NATURAL_KEYS[model])
+  changed = '({}) IS DISTINCT FROM ({})'.format(', '.join('t."{}"'.format(column) for column in columns),
+                                                ', '.join('s."{}"'.format(column) for column in columns))
+  now = "(now() at time zone 'utc')"
+
+  db.session.execute('CREATE TEMP TABLE import_staging AS SELECT {} FROM {} WITH NO DATA'.format(names, table))
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  for row in rows:
+    writer.writerow([row[column].isoformat() if hasattr(row[column], 'isoformat') else row[column]
+                     for column in columns])
+  buffer.seek(0)
+  cursor = db.session.connection().connection.cursor()
+  cursor.copy_expert('COPY import_staging ({}) FROM STDIN WITH (FORMAT csv)'.format(names), buffer)
+
+  updated = db.session.execute(
+    'UPDATE {table} AS t SET {assignments}, version = t.version + 1, updated_at = {now} '
+    'FROM import_staging AS s WHERE {matches} AND {changed}'.format(
+      table=table, now=now, matches=matches, changed=changed,
+      assignments=', '.join('"{0}" = s."{0}"'.format(column) for column in columns))).rowcount
+  inserted = db.session.execute(
+    'INSERT INTO {table} ({names}, version, updated_at) SELECT {values}, 1, {now} '
+    'FROM import_staging AS s WHERE NOT EXISTS (SELECT 1 FROM {table} AS t WHERE {matches})'.format(
+      table=table, names=names, now=now, matches=matches,
+      values=', '.join('s."{}"'.format(column) for column in columns))).rowcount
+  db.session.execute('DROP TABLE import_staging')
+  return inserted, updated
+
+
+def _genre_ids(names):
+  ids = dict(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(names)))
+  missing = [name for name in names if name not in ids]
+  if missing:
+    db.session.execute(Genre.__table__.insert(), [{'name': name} for name in missing])
+    ids.update(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(missing)))
+  return ids
+
+
+def _link_genres(model, rows, genres, known):
+  # replaces the genre links of the rows whose genres field differs from them,
+  # and bumps the rows among them that existed before the chunk (known), like
+  # the ORM does; returns how many it bumped
+  association, owner = _GENRE_LINKS[model]
+  ids = _existing_ids(model, rows)
+  current = defaultdict(set)
+  links = db.session.query(association.c[owner], Genre.name) \
+    .join(Genre, Genre.id == association.c.genre_id) \
+    .filter(association.c[owner].in_(bindparam('owners', expanding=True))) \
+    .params(owners=[ids[key] for key in genres if key in ids])
+  for owner_id, name in links:
+    current[owner_id].add(name)
+  changed = {ids[key]: names for key, names in genres.items() if key in ids and set(names) != current[ids[key]]}
+  if not changed:
+    return 0
+
+  genre_ids = _genre_ids(sorted({name for names in changed.values() for name in names}))
+  owners = list(changed)
+  db.session.execute(association.delete().where(association.c[owner].in_(bindparam('owners', expanding=True))),
+                     {'owners': owners})
+  links = [{owner: owner_id, 'genre_id': genre_ids[name]} for owner_id, names in changed.items() for name in names]
+  if links:
+    db.session.execute(association.insert(), links)
+  bumped = [ids[key] for key in genres if key in known and ids[key] in changed]
+  if bumped:
+    table = model.__table__
+    db.session.execute(table.update().where(table.c.id.in_(bindparam('owners', expanding=True)))
+                       .values(version=table.c.version + 1), {'owners': bumped})
+  return len(bumped)
+
+
+def _without_conflicts(rows):
+  # shows that overlap one already booked, or one accepted earlier in the
+  # chunk, are dropped; the caller holds the write lock until the commit
+  existing = _existing_ids(Show, rows)
+  find_conflict = bulk_conflict_finder()
+  accepted, timelines = [], defaultdict(Timeline)
+  for row in rows:
+    start, end = row['start_time'], row['end_time']
+    own = (timelines[('venue', row['venue_id'])], timelines[('artist', row['artist_id'])])
+    if any(timeline.overlapping(start, end) is not None for timeline in own):
+      continue
+    key = tuple(row[key] for key in NATURAL_KEYS[Show])
+    if find_conflict(row['venue_id'], row['artist_id'], start, end, exclude_id=existing.get(key)) is not None:
+      continue
+    for timeline in own:
+      timeline.add(start, end, None)
+    accepted.append(row)
+  return accepted
+
+
+def import_rows(model, rows, batch_size=5000, progress=None):
+  postgres = db.engine.dialect.name == 'postgresql'
+  upsert = _upsert_copy if postgres else _upsert_executemany
+  resolve = _NameResolver()
+  stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'relinked': 0, 'rejected': 0, 'conflicts': 0}
+  started = time.perf_counter()
+
+  failed = True
+  try:
+    for chunk in _chunks(rows, batch_size):
+      values = [_coerce(model, row, resolve) for row in chunk]
+      stats['rejected'] += values.count(None)
+      # the last occurrence of a natural key within a chunk wins
+      unique = {tuple(row[key] for key in NATURAL_KEYS[model]): row for row in values if row is not None}
+      rows = list(unique.values())
+      genres, known = {}, set()
+      if model in _GENRE_LINKS:
+        genres = {tuple(value[key] for key in NATURAL_KEYS[model]): _parse_genres(row['genres'])
+                  for row, value in zip(chunk, values) if value is not None and 'genres' in row}
+        if genres:
+          known = set(_existing_ids(model, [unique[key] for key in genres]))
+      if model is Show and not postgres:
+        if db.engine.dialect.name == 'sqlite':
+          begin_immediate()
+        rows = _without_conflicts(rows)
+        stats['conflicts'] += len(unique) - len(rows)
+      for columns, group in _group_by_columns(rows):
+        inserted, updated = upsert(model, columns, group)
+        stats['inserted'] += inserted
+        stats['updated'] += updated
+        stats['unchanged'] += len(group) - inserted - updated
+      if genres:
+        stats['relinked'] += _link_genres(model, [unique[key] for key in genres], genres, known)
+      db.session.commit()
+      if progress is not None:
+        progress(stats, time.perf_counter() - started)
+    failed = False
+  except:
+    db.session.rollback()
+    raise
+  finally:
+    # Core statements bypass the session events that invalidate cached pages
+    # and patch the typeahead index of this process (servers poll for the rows);
+    # an import that changed nothing leaves both alone
+    if failed or stats['inserted'] or stats['updated'] or stats['relinked']:
+      cache.invalidate({model.__name__})
+      typeahead.index.mark_stale()
+
+  stats['seconds'] = time.perf_counter() - started
+  return stats
+
+
+@click.command('import')
+@click.option('--venues', 'venue_files', multiple=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--artists', 'artist_files', multiple=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--shows', 'show_files', multiple=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per chunk and commit.')
+@click.option('--offline', is_flag=True,
+              help='No server is running on this database (or it will be restarted), so a per-process '
+                   'page cache is fine.')
+@with_appcontext
+def import_data(venue_files, artist_files, show_files, batch_size, offline):
+  """Upsert venues, artists and shows from CSV, JSON or NDJSON files."""
+  # the invalidation only reaches the running servers through a shared cache
+  if isinstance(cache.backend, MemoryCache) and not offline:
+    raise click.ClickException(
+      'The page cache is per process (CACHE_BACKEND=memory): running servers would keep serving '
+      'pages and calendars from before the import until they expire. Import with CACHE_BACKEND=redis, '
+      'or pass --offline if no server is running.')
+  for model, paths in ((Venue, venue_files), (Artist, artist_files), (Show, show_files)):
+    for path in paths:
+      def progress(stats, seconds):
+        done = stats['inserted'] + stats['updated'] + stats['unchanged'] + stats['rejected'] + stats['conflicts']
+        click.echo('\r{}: {} rows, {:.0f} rows/s'.format(path, done, done / max(seconds, 1e-9)), nl=False, err=True)
+
+      stats = import_rows(model, read_rows(path), batch_size=batch_size, progress=progress)
+      total = stats['inserted'] + stats['updated'] + stats['unchanged'] + stats['rejected'] + stats['conflicts']
+      click.echo('', err=True)
+      click.echo('{}: {} inserted, {} updated, {} unchanged, {} genre lists changed, {} rejected, '
+                 '{} double bookings in {:.1f}s ({:.0f} rows/s)'.format(
+        path, stats['inserted'], stats['updated'], stats['unchanged'], stats['relinked'], stats['rejected'],
+        stats['conflicts'], stats['seconds'], total / max(stats['seconds'], 1e-9)))
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# SQL instrumentation.
+#----------------------------------------------------------------------------#
+
+class QueryStats(object):
+
+    def __init__(self):
+      self.count = 0
+      self.duration = 0.0
+      self.statements = Counter()
+      # /search records from its worker threads too
+      self._lock = threading.Lock()
+
+    def record(self, statement, duration):
+      with self._lock:
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+      # the same statement shape run again and again in one unit of work is an N+1
+      return [(statement, count) for statement, count in self.statements.most_common()
+              if count >= threshold]
+
+# collectors opened by assert_max_queries / count_queries, outside any request
+_collectors = []
+
+
+def _active_collectors():
+  collectors = list(_collectors)
+  if has_app_context():
+    # sql_timeline: the statements of a profiled request
+    collectors.extend(g.get(name) for name in ('sql_stats', 'sql_timeline') if name in g)
+  return collectors
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  duration = time.perf_counter() - conn.info['query_start_time'].pop()
+  for stats in _active_collectors():
+    stats.record(statement, duration)
+
+
+def init_instrumentation(app):
+  if not app.config.get('SQL_INSTRUMENTATION', True):
+    return
+
+  @app.before_request
+  def start_sql_stats():
+    g.sql_stats = QueryStats()
+
+  @app.after_request
+  def report_sql_stats(response):
+    stats = g.get('sql_stats')
+    if stats is None:
+      return response
+    response.headers['X-DB-Query-Count'] = str(stats.count)
+    response.headers['X-DB-Time'] = '{:.2f}ms'.format(stats.duration * 1000)
+
+    if app.debug:
+      app.logger.debug('%s %s: %d queries in %.2fms', request.method, request.path,
+                       stats.count, stats.duration * 1000)
+      for statement, count in stats.repeated(app.config['SQL_N_PLUS_ONE_THRESHOLD']):
+        app.logger.warning('Possible N+1: statement ran %d times: %s', count, ' '.join(statement.split()))
+    return response
+
+
+@contextmanager
+def count_queries():
+  stats = QueryStats()
+  _collectors.append(stats)
+  try:
+    yield stats
+  finally:
+    _collectors.remove(stats)
+
+
+@contextmanager
+def assert_max_queries(max_queries):
+  # e.g. `with assert_max_queries(2): client.get('/venues')`
+  with count_queries() as stats:
+    yield stats
+  if stats.count > max_queries:
+    shapes = '\n'.join('{} x {}'.format(count, statement) for statement, count in stats.statements.most_common())
+    raise AssertionError('Expected at most {} queries, got {}:\n{}'.format(max_queries, stats.count, shapes))
+
+
+def pool_status(engine):
+  pool = engine.pool
+  status = {'class': type(pool).__name__}
+  # only QueuePool-style pools report sizes (SQLite uses NullPool/SingletonThreadPool)
+  for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+    if hasattr(pool, name):
+      status[name] = getattr(pool, name)()
+  if 'size' in status and 'checkedout' in status:
+    status['utilization'] = round(float(status['checkedout']) / max(status['size'], 1), 3)
+  return status
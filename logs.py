@@ -0,0 +1,185 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+#----------------------------------------------------------------------------#
+# Structured logging.
+#----------------------------------------------------------------------------#
+
+# Request threads only put records on a queue; a listener thread per process
+# formats them as one JSON object per line and does the I/O. DEBUG records
+# (the payload dumps) are sampled and rate limited before they are enqueued,
+# so the ones dropped cost neither formatting nor a queue slot.
+
+# LogRecord attributes that are not extra= fields
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+# an X-Request-ID from a proxy is reused only if it looks like one
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,128}$')
+
+
+class RequestContextFilter(logging.Filter):
+    # runs in the thread that logs, where the request is still bound
+
+    def filter(self, record):
+      if has_request_context():
+        record.request_id = g.get('request_id')
+        record.method = request.method
+        record.path = request.path
+      return True
+
+
+class SamplingFilter(logging.Filter):
+    # keeps a sample_rate share of the records at or below `level`, and at
+    # most rate_limit of them per second for each message template
+
+    def __init__(self, level=logging.DEBUG, sample_rate=1.0, rate_limit=0):
+      super(SamplingFilter, self).__init__()
+      self.level = level
+      self.sample_rate = sample_rate
+      self.rate_limit = rate_limit
+      self.dropped = 0
+      self._windows = {}
+      self._lock = threading.Lock()
+
+    def filter(self, record):
+      if record.levelno > self.level:
+        return True
+      if self.sample_rate < 1 and random.random() >= self.sample_rate:
+        return self._drop()
+      if self.rate_limit:
+        second = int(time.monotonic())
+        key = (record.name, record.msg)
+        with self._lock:
+          window, count = self._windows.get(key, (second, 0))
+          if window != second:
+            window, count = second, 0
+          if count >= self.rate_limit:
+            return self._drop()
+          self._windows[key] = (window, count + 1)
+      return True
+
+    def _drop(self):
+      self.dropped += 1
+      return False
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+      entry = {'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+               'level': record.levelname,
+               'logger': record.name,
+               'message': record.getMessage()}
+      for key, value in vars(record).items():
+        if key not in _RESERVED and value is not None:
+          entry[key] = value
+      if record.exc_info:
+        entry['exc_info'] = self.formatException(record.exc_info)
+      elif record.exc_text:
+        entry['exc_info'] = record.exc_text
+      return json.dumps(entry, default=str)
+
+
+class AsyncHandler(QueueHandler):
+    # the listener thread does not survive a fork, so a worker forked from a
+    # preloaded master starts its own on its first record
+
+    def __init__(self, *handlers):
+      super(AsyncHandler, self).__init__(queue.SimpleQueue())
+      self.handlers = handlers
+      self.listener = None
+      self._pid = None
+      self._lock = threading.Lock()
+      self.sampling = None
+
+    def start(self):
+      with self._lock:
+        if self._pid == os.getpid():
+          return
+        self.queue = queue.SimpleQueue()
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        self._pid = os.getpid()
+
+    def stop(self):
+      with self._lock:
+        if self.listener is not None and self._pid == os.getpid():
+          self.listener.stop()
+        self.listener = None
+        self._pid = None
+
+    def prepare(self, record):
+      # the message is merged and the traceback rendered here, while args and
+      # the exception may still change; extra= fields travel as they are
+      record = copy.copy(record)
+      record.msg = record.getMessage()
+      record.args = None
+      if record.exc_info:
+        record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+      return record
+
+    def status(self):
+      return {'queued': self.queue.qsize(), 'debug_dropped': self.sampling.dropped}
+
+    def enqueue(self, record):
+      if self._pid != os.getpid():
+        self.start()
+      self.queue.put_nowait(record)
+
+
+def _level(value):
+  return value if isinstance(value, int) else logging.getLevelName(str(value).upper())
+
+
+def init_logging(app):
+  formatter = JsonFormatter() if app.config['LOG_JSON'] else \
+    logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+  if app.config['LOG_FILE']:
+    handler = RotatingFileHandler(app.config['LOG_FILE'], maxBytes=app.config['LOG_FILE_MAX_BYTES'],
+                                  backupCount=app.config['LOG_FILE_BACKUPS'])
+  else:
+    handler = logging.StreamHandler(sys.stderr)
+  handler.setFormatter(formatter)
+
+  async_handler = AsyncHandler(handler)
+  async_handler.sampling = SamplingFilter(sample_rate=app.config['LOG_DEBUG_SAMPLE_RATE'],
+                                          rate_limit=app.config['LOG_DEBUG_RATE_LIMIT'])
+  async_handler.addFilter(async_handler.sampling)
+  async_handler.addFilter(RequestContextFilter())
+  async_handler.start()
+  atexit.register(async_handler.stop)
+
+  # everything propagates to the root logger; Flask's own stderr handler would print twice
+  app.logger.removeHandler(default_handler)
+  app.logger.setLevel(_level(app.config['LOG_LEVEL']))
+  root = logging.getLogger()
+  root.addHandler(async_handler)
+  root.setLevel(_level(app.config['LOG_ROOT_LEVEL']))
+  for name, level in app.config['LOG_LEVELS'].items():
+    logging.getLogger(name).setLevel(_level(level))
+  app.extensions['logging'] = async_handler
+
+  @app.before_request
+  def assign_request_id():
+    request_id = request.headers.get('X-Request-ID', '')
+    g.request_id = request_id if _REQUEST_ID.match(request_id) else uuid.uuid4().hex
+
+  @app.after_request
+  def send_request_id(response):
+    if 'request_id' in g:
+      response.headers['X-Request-ID'] = g.request_id
+    return response
@@ -0,0 +1,87 @@
+import os
+import time
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from instrumentation import pool_status
+
+#----------------------------------------------------------------------------#
+# Prometheus metrics.
+#----------------------------------------------------------------------------#
+
+# Under gunicorn set PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py) before
+# the app is imported: every worker then writes its samples to mmapped files
+# in that directory and /metrics, whichever worker serves it, adds them all
+# up. Without it the numbers are those of the serving process only.
+
+_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, float('inf'))
+_DB_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, float('inf'))
+
+requests_total = Counter('fyyur_http_requests_total', 'Requests served, by route and status',
+                         ['method', 'route', 'status'])
+request_duration = Histogram('fyyur_http_request_duration_seconds', 'Time to serve a request',
+                             ['method', 'route'])
+response_size = Histogram('fyyur_http_response_size_bytes', 'Response body size, when known up front',
+                          ['method', 'route'], buckets=_SIZE_BUCKETS)
+db_duration = Histogram('fyyur_db_duration_seconds', 'Time spent in SQL per request',
+                        ['method', 'route'], buckets=_DB_BUCKETS)
+db_queries = Counter('fyyur_db_queries_total', 'SQL statements run by requests', ['method', 'route'])
+cache_requests = Counter('fyyur_cache_requests_total', 'Page cache lookups; hits / all is the hit rate',
+                         ['kind', 'result'])
+pool_connections = Gauge('fyyur_db_pool_connections', 'Connections of the workers\' pools, by state',
+                         ['state'], multiprocess_mode='livesum')
+pool_size = Gauge('fyyur_db_pool_size', 'Configured pool size summed over live workers',
+                  multiprocess_mode='livesum')
+
+_POOL_STATES = ('checkedin', 'checkedout', 'overflow')
+
+
+def _route():
+  # the rule, not the path, so ids do not make a series each
+  return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _update_pool(engine):
+  status = pool_status(engine)
+  if 'size' in status:
+    pool_size.set(status['size'])
+  for state in _POOL_STATES:
+    if state in status:
+      pool_connections.labels(state).set(status[state])
+
+
+def init_metrics(app, db):
+  if not app.config.get('METRICS_ENABLED', True):
+    return
+
+  @app.before_request
+  def start_request_timer():
+    g.metrics_start = time.perf_counter()
+
+  @app.after_request
+  def record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None or request.endpoint == 'metrics':
+      return response
+    method, route = request.method, _route()
+    request_duration.labels(method, route).observe(time.perf_counter() - start)
+    requests_total.labels(method, route, str(response.status_code)).inc()
+    size = response.calculate_content_length()
+    if size is not None:
+      response_size.labels(method, route).observe(size)
+    stats = g.get('sql_stats')
+    if stats is not None:
+      db_duration.labels(method, route).observe(stats.duration)
+      db_queries.labels(method, route).inc(stats.count)
+    _update_pool(db.engine)
+    return response
+
+  @app.route('/metrics')
+  def metrics():
+    _update_pool(db.engine)
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+      registry = CollectorRegistry()
+      multiprocess.MultiProcessCollector(registry)
+    else:
+      registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -79,6 +79,10 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # batch migrations rebuild tables by dropping them, which with
+            # foreign keys enforced would cascade into the referencing rows
+            connection.execute('PRAGMA foreign_keys = OFF')
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
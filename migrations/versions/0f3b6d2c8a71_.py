@@ -0,0 +1,50 @@
+"""cascade deletes from venues, artists and genres
+
+Revision ID: 0f3b6d2c8a71
+Revises: 5c0d8e6a9f12
+Create Date: 2026-10-18 18:22:37.104866
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0f3b6d2c8a71'
+down_revision = '5c0d8e6a9f12'
+branch_labels = None
+depends_on = None
+
+# (table, column, referred table); the constraints were created unnamed, and
+# the naming convention reproduces the names Postgres gave them
+FOREIGN_KEYS = (('Show', 'venue_id', 'Venue'),
+                ('Show', 'artist_id', 'Artist'),
+                ('VenueGenre', 'venue_id', 'Venue'),
+                ('VenueGenre', 'genre_id', 'Genre'),
+                ('ArtistGenre', 'artist_id', 'Artist'),
+                ('ArtistGenre', 'genre_id', 'Genre'))
+NAMING_CONVENTION = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
+
+# SQLite does not reflect CHECK constraints, so the rebuilt table is given its own
+TABLE_ARGS = {'Show': (sa.CheckConstraint('end_time > start_time', name='ck_Show_end_after_start'),)}
+
+
+def _replace_foreign_keys(ondelete):
+    for table in ('Show', 'VenueGenre', 'ArtistGenre'):
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION,
+                                  table_args=TABLE_ARGS.get(table, ())) as batch_op:
+            for source, column, referent in FOREIGN_KEYS:
+                if source != table:
+                    continue
+                name = '{}_{}_fkey'.format(table, column)
+                batch_op.drop_constraint(name, type_='foreignkey')
+                batch_op.create_foreign_key(name, referent, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    _replace_foreign_keys(None)
@@ -0,0 +1,59 @@
+"""trigram name search indexes
+
+Revision ID: 472470cb31ec
+Revises: 89679fb2261e
+Create Date: 2026-10-18 09:12:41.503214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '472470cb31ec'
+down_revision = '89679fb2261e'
+branch_labels = None
+depends_on = None
+
+
+def _sqlite_statements(table):
+    fts = '"{}_name_trgm"'.format(table)
+    return [
+        'CREATE VIRTUAL TABLE {fts} USING fts5('
+        'name, content=\'{t}\', content_rowid=\'id\', tokenize=\'trigram\')',
+        'CREATE TRIGGER "{t}_name_trgm_ai" AFTER INSERT ON "{t}" BEGIN '
+        'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END',
+        'CREATE TRIGGER "{t}_name_trgm_ad" AFTER DELETE ON "{t}" BEGIN '
+        'INSERT INTO {fts}({fts}, rowid, name) VALUES (\'delete\', old.id, old.name); END',
+        'CREATE TRIGGER "{t}_name_trgm_au" AFTER UPDATE OF name ON "{t}" BEGIN '
+        'INSERT INTO {fts}({fts}, rowid, name) VALUES (\'delete\', old.id, old.name); '
+        'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END',
+        'INSERT INTO {fts}({fts}) VALUES (\'rebuild\')',
+    ], fts
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in ('Venue', 'Artist'):
+            statements, fts = _sqlite_statements(table)
+            for statement in statements:
+                op.execute(statement.format(t=table, fts=fts))
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_Venue_name_trgm', 'Venue', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_Artist_name_trgm', 'Artist', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in ('Venue', 'Artist'):
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute('DROP TRIGGER IF EXISTS "{}_name_trgm_{}"'.format(table, suffix))
+            op.execute('DROP TABLE IF EXISTS "{}_name_trgm"'.format(table))
+        return
+
+    op.drop_index('ix_Artist_name_trgm', table_name='Artist')
+    op.drop_index('ix_Venue_name_trgm', table_name='Venue')
@@ -0,0 +1,105 @@
+"""genre table and venue/artist genre links
+
+Revision ID: 5c0d8e6a9f12
+Revises: e2a4f7c81b39
+Create Date: 2026-10-18 17:05:51.930417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c0d8e6a9f12'
+down_revision = 'e2a4f7c81b39'
+branch_labels = None
+depends_on = None
+
+OWNERS = (('Venue', 'VenueGenre', 'venue_id'), ('Artist', 'ArtistGenre', 'artist_id'))
+
+
+def _parse_genres(value):
+    # comma-joined names, or the "{a,b}" / "['a', 'b']" text a list written
+    # into the string column came out as
+    names = (value or '').strip().strip('{}[]').split(',')
+    return [name.strip().strip('"\'').strip() for name in names if name.strip().strip('"\'').strip()]
+
+
+def _restore_name_search(table):
+    # a batch rebuild of Venue/Artist on SQLite drops the triggers that keep
+    # the FTS5 name index (472470cb31ec) in step, so they are put back and
+    # the index rebuilt from the new table
+    fts = '"{}_name_trgm"'.format(table)
+    for statement in (
+            'CREATE TRIGGER IF NOT EXISTS "{t}_name_trgm_ai" AFTER INSERT ON "{t}" BEGIN '
+            'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END',
+            'CREATE TRIGGER IF NOT EXISTS "{t}_name_trgm_ad" AFTER DELETE ON "{t}" BEGIN '
+            'INSERT INTO {fts}({fts}, rowid, name) VALUES (\'delete\', old.id, old.name); END',
+            'CREATE TRIGGER IF NOT EXISTS "{t}_name_trgm_au" AFTER UPDATE OF name ON "{t}" BEGIN '
+            'INSERT INTO {fts}({fts}, rowid, name) VALUES (\'delete\', old.id, old.name); '
+            'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END',
+            'INSERT INTO {fts}({fts}) VALUES (\'rebuild\')'):
+        op.execute(statement.format(t=table, fts=fts))
+
+
+def upgrade():
+    genre = op.create_table('Genre',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=120), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    links = {}
+    for owner, table, column in OWNERS:
+        links[owner] = op.create_table(table,
+            sa.Column(column, sa.Integer(), nullable=False),
+            sa.Column('genre_id', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ),
+            sa.ForeignKeyConstraint([column], ['{}.id'.format(owner)], ),
+            sa.PrimaryKeyConstraint(column, 'genre_id')
+        )
+        op.create_index('ix_{}_genre_id_{}'.format(table, column), table, ['genre_id', column], unique=False)
+
+    bind = op.get_bind()
+    rows = {owner: bind.execute(sa.text('SELECT id, genres FROM "{}" WHERE genres IS NOT NULL'.format(owner))).fetchall()
+            for owner, _, _ in OWNERS}
+    names = sorted({name for owner_rows in rows.values() for _, value in owner_rows for name in _parse_genres(value)})
+    if names:
+        op.bulk_insert(genre, [{'name': name} for name in names])
+    ids = dict(bind.execute(sa.text('SELECT name, id FROM "Genre"')).fetchall())
+    for owner, _, column in OWNERS:
+        owner_links = [{column: id, 'genre_id': ids[name]}
+                       for id, value in rows[owner] for name in set(_parse_genres(value))]
+        if owner_links:
+            op.bulk_insert(links[owner], owner_links)
+
+    if bind.dialect.name == 'postgresql':
+        op.drop_index('ix_Artist_genres_trgm', table_name='Artist')
+    for owner, _, _ in OWNERS:
+        with op.batch_alter_table(owner) as batch_op:
+            batch_op.drop_column('genres')
+        if bind.dialect.name == 'sqlite':
+            _restore_name_search(owner)
+
+
+def downgrade():
+    bind = op.get_bind()
+    for owner, table, column in OWNERS:
+        with op.batch_alter_table(owner) as batch_op:
+            batch_op.add_column(sa.Column('genres', sa.String(length=120), nullable=True))
+        if bind.dialect.name == 'sqlite':
+            _restore_name_search(owner)
+        joined = {}
+        for id, name in bind.execute(sa.text(
+                'SELECT l.{0}, g.name FROM "{1}" l JOIN "Genre" g ON g.id = l.genre_id '
+                'ORDER BY l.{0}, g.name'.format(column, table))):
+            joined.setdefault(id, []).append(name)
+        for id, names in joined.items():
+            bind.execute(sa.text('UPDATE "{}" SET genres = :genres WHERE id = :id'.format(owner)),
+                         genres=','.join(names), id=id)
+        op.drop_index('ix_{}_genre_id_{}'.format(table, column), table_name=table)
+        op.drop_table(table)
+    op.drop_table('Genre')
+    if bind.dialect.name == 'postgresql':
+        op.create_index('ix_Artist_genres_trgm', 'Artist', ['genres'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'genres': 'gin_trgm_ops'})
@@ -0,0 +1,42 @@
+"""updated_at and version columns
+
+Revision ID: 73ddf2a0821a
+Revises: d873a2eb5f73
+Create Date: 2026-10-18 11:26:03.772410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '73ddf2a0821a'
+down_revision = 'd873a2eb5f73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing rows are stamped with the migration time (UTC); SQLite only
+    # accepts a constant default when adding a NOT NULL column, so there the
+    # rows are stamped by an UPDATE right after
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    if sqlite:
+        now = sa.text("'1970-01-01 00:00:00'")
+    else:
+        now = sa.text("(now() at time zone 'utc')")
+
+    for table in ('Artist', 'Venue', 'Show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=now))
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+        op.create_index(op.f('ix_{}_updated_at'.format(table)), table, ['updated_at'], unique=False)
+        if sqlite:
+            op.execute('UPDATE "{}" SET updated_at = CURRENT_TIMESTAMP'.format(table))
+
+
+def downgrade():
+    for table in ('Show', 'Venue', 'Artist'):
+        op.drop_index(op.f('ix_{}_updated_at'.format(table)), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
+            batch_op.drop_column('updated_at')
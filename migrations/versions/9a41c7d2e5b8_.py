@@ -0,0 +1,57 @@
+"""table versions bumped by triggers
+
+Revision ID: 9a41c7d2e5b8
+Revises: 0f3b6d2c8a71
+Create Date: 2026-10-18 20:41:09.318254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a41c7d2e5b8'
+down_revision = '0f3b6d2c8a71'
+branch_labels = None
+depends_on = None
+
+TABLES = ('Venue', 'Artist', 'Show')
+SQLITE_OPERATIONS = (('ai', 'INSERT'), ('au', 'UPDATE'), ('ad', 'DELETE'))
+
+
+def upgrade():
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    now = 'CURRENT_TIMESTAMP' if sqlite else "(now() at time zone 'utc')"
+    op.create_table('TableVersion',
+        sa.Column('name', sa.String(length=64), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    if not sqlite:
+        op.execute('CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$ BEGIN '
+                   'UPDATE "TableVersion" SET version = version + 1, updated_at = now() at time zone \'utc\' '
+                   'WHERE name = TG_TABLE_NAME; RETURN NULL; END $$ LANGUAGE plpgsql')
+    for table in TABLES:
+        op.execute('INSERT INTO "TableVersion" (name, version, updated_at) VALUES (\'{}\', 1, {})'.format(table, now))
+        if sqlite:
+            for suffix, operation in SQLITE_OPERATIONS:
+                op.execute('CREATE TRIGGER "{t}_version_{suffix}" AFTER {operation} ON "{t}" BEGIN '
+                           'UPDATE "TableVersion" SET version = version + 1, updated_at = CURRENT_TIMESTAMP '
+                           'WHERE name = \'{t}\'; END'.format(t=table, suffix=suffix, operation=operation))
+        else:
+            op.execute('CREATE TRIGGER "{t}_version" AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "{t}" '
+                       'FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()'.format(t=table))
+
+
+def downgrade():
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    for table in TABLES:
+        if sqlite:
+            for suffix, _ in SQLITE_OPERATIONS:
+                op.execute('DROP TRIGGER IF EXISTS "{}_version_{}"'.format(table, suffix))
+        else:
+            op.execute('DROP TRIGGER IF EXISTS "{0}_version" ON "{0}"'.format(table))
+    if not sqlite:
+        op.execute('DROP FUNCTION IF EXISTS bump_table_version()')
+    op.drop_table('TableVersion')
@@ -0,0 +1,29 @@
+"""show search indexes
+
+Revision ID: b5e1c93d07a4
+Revises: 73ddf2a0821a
+Create Date: 2026-10-18 14:12:48.205713
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e1c93d07a4'
+down_revision = '73ddf2a0821a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Venue_state_city', 'Venue', ['state', 'city'], unique=False)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index('ix_Artist_genres_trgm', 'Artist', ['genres'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'genres': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_Artist_genres_trgm', table_name='Artist')
+    op.drop_index('ix_Venue_state_city', table_name='Venue')
@@ -0,0 +1,57 @@
+"""show end_time and double-booking constraints
+
+Revision ID: e2a4f7c81b39
+Revises: b5e1c93d07a4
+Create Date: 2026-10-18 15:40:09.611284
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a4f7c81b39'
+down_revision = 'b5e1c93d07a4'
+branch_labels = None
+depends_on = None
+
+# SHOW_DEFAULT_DURATION when this revision was written
+DEFAULT_DURATION_MINUTES = 180
+
+
+def upgrade():
+    bind = op.get_bind()
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    if bind.dialect.name == 'sqlite':
+        # keep the fractional seconds suffix so string comparisons still order correctly
+        op.execute("UPDATE \"Show\" SET end_time = datetime(start_time, '+{} minutes') || "
+                   "substr(start_time, 20)".format(DEFAULT_DURATION_MINUTES))
+    else:
+        op.execute("UPDATE \"Show\" SET end_time = start_time + interval '{} minutes'".format(DEFAULT_DURATION_MINUTES))
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.create_check_constraint('ck_Show_end_after_start', 'end_time > start_time')
+
+    if bind.dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    for kind in ('venue', 'artist'):
+        overlaps = bind.execute(sa.text(
+            'SELECT count(*) FROM "Show" a JOIN "Show" b ON a.{0}_id = b.{0}_id AND a.id < b.id '
+            'AND tsrange(a.start_time, a.end_time) && tsrange(b.start_time, b.end_time)'.format(kind))).scalar()
+        if overlaps:
+            raise RuntimeError('{} pairs of shows double-book the same {}; resolve them before '
+                               'upgrading'.format(overlaps, kind))
+        op.execute('ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_{0}_overlap" EXCLUDE USING gist '
+                   '({0}_id WITH =, tsrange(start_time, end_time) WITH &&)'.format(kind))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for kind in ('artist', 'venue'):
+            op.execute('ALTER TABLE "Show" DROP CONSTRAINT "ex_Show_{}_overlap"'.format(kind))
+    with op.batch_alter_table('Show') as batch_op:
+        # SQLite CHECK constraints are not reflected, so the table rebuild drops it
+        if dialect != 'sqlite':
+            batch_op.drop_constraint('ck_Show_end_after_start', type_='check')
+        batch_op.drop_column('end_time')
@@ -1,42 +1,120 @@
-from flask_sqlalchemy import SQLAlchemy
-from util import format_datetime
-from datetime import datetime
+import sqlite3
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import DDL, event, orm
+from sqlalchemy.engine import Engine
+from datetime import datetime, timedelta
+from itertools import groupby
 
-db = SQLAlchemy()
+class RoutingSession(SignallingSession):
+    # reads go to the replica picked for the request (see replicas.py);
+    # flushes, and requests without one, use the primary
+
+    def get_bind(self, mapper=None, clause=None):
+      replica = g.get('read_replica') if has_app_context() else None
+      if replica is not None and not self._flushing:
+        return replica
+      return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+      return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+  # SQLite only enforces foreign keys, and so ON DELETE CASCADE, when asked to
+  if isinstance(dbapi_connection, sqlite3.Connection):
+    dbapi_connection.execute('PRAGMA foreign_keys = ON')
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
+def default_end_time(start_time):
+  if start_time is None:
+    return None
+  return start_time + timedelta(minutes=current_app.config['SHOW_DEFAULT_DURATION'])
+
+
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+      db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+      db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+      db.Index('ix_Show_start_time', 'start_time'),
+      db.CheckConstraint('end_time > start_time', name='ck_Show_end_after_start'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime())
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
-    venue = db.relationship('Venue', backref=db.backref('shows', cascade='all, delete'))
-    artist = db.relationship('Artist', backref=db.backref('shows', cascade='all, delete'))
+    end_time = db.Column(db.DateTime(),
+                         default=lambda context: default_end_time(context.get_current_parameters().get('start_time')))
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
+    # the database deletes the shows of a deleted venue or artist; they are not loaded first
+    venue = db.relationship('Venue', backref=db.backref('shows', cascade='all, delete', passive_deletes=True))
+    artist = db.relationship('Artist', backref=db.backref('shows', cascade='all, delete', passive_deletes=True))
+    updated_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    version = db.Column(db.Integer, nullable=False)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
-      return f'\n<Show: id: {self.id},\nstart_time: {self.start_time},\nvenue_id: {self.venue_id},\nartist_id: {self.artist_id}>\n'
+      return f'\n<Show: id: {self.id},\nstart_time: {self.start_time},\nend_time: {self.end_time},\nvenue_id: {self.venue_id},\nartist_id: {self.artist_id}>\n'
 
-    @property
-    def _get_shows(self):
-      return {'venue_id' : self.venue_id,
-              'venue_name': self.venue.name,
-              'artist_id': self.artist_id,
-              'artist_name' : self.artist.name,
-              'artist_image_link': self.artist.image_link,
-              'start_time': format_datetime(str(self.start_time), format='full')
-              }
+    @classmethod
+    def _shows_page_query(cls, after=None, limit=None, start=None, end=None, criteria=()):
+      # keyset pagination on (start_time, id); venue and artist come from the same query,
+      # so criteria may filter on either of them
+      query = db.session.query(cls.id, cls.start_time, cls.venue_id, Venue.name,
+                               cls.artist_id, Artist.name, Artist.image_link) \
+        .join(Venue, Venue.id == cls.venue_id) \
+        .join(Artist, Artist.id == cls.artist_id) \
+        .filter(cls.start_time != None, *criteria)
+      if start is not None:
+        query = query.filter(cls.start_time >= start)
+      if end is not None:
+        query = query.filter(cls.start_time < end)
+      if after is not None:
+        after_time, after_id = after
+        query = query.filter(db.or_(cls.start_time > after_time,
+                                    db.and_(cls.start_time == after_time, cls.id > after_id)))
+      query = query.order_by(cls.start_time, cls.id)
+      if limit:
+        query = query.limit(limit + 1)
+      return query
+
+    @classmethod
+    def _get_shows_page(cls, after=None, limit=None, start=None, end=None, criteria=()):
+      rows = cls._shows_page_query(after=after, limit=limit, start=start, end=end, criteria=criteria).all()
+
+      next_cursor = None
+      if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1][1], rows[-1][0])
+
+      data = [{'venue_id' : venue_id,
+               'venue_name': venue_name,
+               'artist_id': artist_id,
+               'artist_name' : artist_name,
+               'artist_image_link': artist_image_link,
+               'start_time': start_time
+               }
+              for _, start_time, venue_id, venue_name, artist_id, artist_name, artist_image_link in rows]
+      return data, next_cursor
 
     @property
     def _get_show_artist_time(self):
       return {'artist_id': self.artist_id,
               'artist_name': self.artist.name,
               'artist_image_link': self.artist.image_link,
-              'start_time': format_datetime(str(self.start_time), format='full')
+              'start_time': self.start_time
               }
 
     @property
@@ -44,16 +122,101 @@ class Show(db.Model):
       return {'venue_id': self.venue_id,
               'venue_name': self.venue.name,
               'venue_image_link': self.venue.image_link,
-              'start_time': format_datetime(str(self.start_time), format='full')
+              'start_time': self.start_time
+              }
+
+    @classmethod
+    def _timeline_query(cls, criterion, counterpart, now, past=False):
+      # both halves read (venue_id|artist_id, start_time) in index order
+      query = cls.query.options(db.joinedload(counterpart)).filter(criterion)
+      if past:
+        return query.filter(cls.start_time < now).order_by(cls.start_time.desc(), cls.id.desc())
+      return query.filter(cls.start_time > now).order_by(cls.start_time, cls.id)
+
+    @classmethod
+    def _get_timeline(cls, criterion, counterpart, serializer, past_page=1, past_per_page=None):
+      # past/upcoming and their counts are split around a single `now`; only
+      # the requested page of past shows is read, off (venue_id|artist_id, start_time)
+      now = datetime.now()
+      past_count, upcoming_count = db.session.query(
+        db.func.coalesce(db.func.sum(db.case([(cls.start_time < now, 1)], else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case([(cls.start_time > now, 1)], else_=0)), 0)) \
+        .filter(criterion, cls.start_time != None).one()
+
+      upcoming_shows = cls._timeline_query(criterion, counterpart, now).all()
+
+      past_page = max(past_page, 1)
+      past_shows = cls._timeline_query(criterion, counterpart, now, past=True)
+      past_has_next = False
+      if past_per_page:
+        start = (past_page - 1) * past_per_page
+        past_shows = past_shows.limit(past_per_page).offset(start)
+        past_has_next = past_count > start + past_per_page
+
+      return {'past_shows': [serializer(x) for x in past_shows],
+              'upcoming_shows': [serializer(x) for x in upcoming_shows],
+              'past_shows_count': past_count,
+              'upcoming_shows_count': upcoming_count,
+              'past_shows_page': past_page,
+              'past_shows_has_next': past_has_next
               }
-          
+
+
+class Genre(db.Model):
+    __tablename__ = 'Genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+    def __repr__(self):
+      return f'<Genre: id: {self.id}, name: {self.name}>'
+
+    @classmethod
+    def _get_or_create(cls, names):
+      names = list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+      existing = {genre.name: genre for genre in cls.query.filter(cls.name.in_(names))} if names else {}
+      genres = []
+      for name in names:
+        genre = existing.get(name)
+        if genre is None:
+          genre = cls(name=name)
+          db.session.add(genre)
+        genres.append(genre)
+      return genres
+
+    @classmethod
+    def _members(cls, association, name):
+      # ids of the venues/artists with a genre, read off the (genre_id, owner) index;
+      # Genre itself is a few dozen rows, so the case-insensitive name match is free
+      owner = [column for column in association.c if column.name != 'genre_id'][0]
+      genre_ids = db.session.query(cls.id).filter(db.func.lower(cls.name) == name.strip().lower())
+      return db.session.query(owner).filter(association.c.genre_id.in_(genre_ids))
+
+
+VenueGenre = db.Table('VenueGenre',
+  db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True),
+  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+  db.Index('ix_VenueGenre_genre_id_venue_id', 'genre_id', 'venue_id'),
+)
+
+ArtistGenre = db.Table('ArtistGenre',
+  db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True),
+  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+  db.Index('ix_ArtistGenre_genre_id_artist_id', 'genre_id', 'artist_id'),
+)
+
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+      db.Index('ix_Venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+      db.Index('ix_Venue_state_city', 'state', 'city'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
-    genres = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=VenueGenre, order_by=Genre.name,
+                             passive_deletes=True)
     address = db.Column(db.String(120))
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
@@ -63,15 +226,30 @@ class Venue(db.Model):
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
     image_link = db.Column(db.String(500))
+    updated_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    version = db.Column(db.Integer, nullable=False)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
-      return f'\n<Venue: id: {self.id},\nname: {self.name},\ngenres: {self.genres},\naddress: {self.address},\ncity: {self.city},\nstate: {self.state},\nphone: {self.phone},\nwebsite: {self.website},\nfacebook_link: {self.facebook_link},\nseeking_talent: {self.seeking_talent},\nseeking_description: {self.seeking_description},\nimage_link: {self.image_link}>\n'
+      return f'\n<Venue: id: {self.id},\nname: {self.name},\ngenres: {self._genre_names},\naddress: {self.address},\ncity: {self.city},\nstate: {self.state},\nphone: {self.phone},\nwebsite: {self.website},\nfacebook_link: {self.facebook_link},\nseeking_talent: {self.seeking_talent},\nseeking_description: {self.seeking_description},\nimage_link: {self.image_link}>\n'
+
+    @property
+    def _genre_names(self):
+      return [genre.name for genre in self.genres]
+
+    def _set_genres(self, names):
+      genres = Genre._get_or_create(names)
+      if set(genres) != set(self.genres):
+        self.genres = genres
+        # link table changes alone do not bump version/updated_at, which ETags rely on
+        self.updated_at = datetime.utcnow()
 
     @property
     def serialize(self):
         return {'id': self.id,
               'name': self.name,
-              'genres': self.genres.split(','),
+              'genres': self._genre_names,
               'address': self.address,
               'city': self.city,
               'state': self.state,
@@ -83,21 +261,10 @@ class Venue(db.Model):
               'image_link' : self.image_link
               }
 
-    @property
-    def _get_venues_by_search(self):
-      return {"id": self.id,
-              "name": self.name,
-              "num_upcoming_shows": Show.query.filter(
-                Show.start_time > datetime.now(),
-                Show.venue_id == self.id
-              ).count()
-            }
-
-    @property
-    def _get_venue_with_show_info(self):
-      return {'id': self.id,
+    def _get_venue_with_show_info(self, past_page=1, past_per_page=None):
+      venue = {'id': self.id,
               'name': self.name,
-              'genres': self.genres,
+              'genres': self._genre_names,
               'address': self.address,
               'city': self.city,
               'state': self.city,
@@ -106,50 +273,57 @@ class Venue(db.Model):
               'facebook_link': self.facebook_link,
               'seeking_talent': self.seeking_talent,
               'seeking_description': self.seeking_description,
-              'image_link' : self.image_link,
-              'past_shows' : [x._get_show_artist_time for x in Show.query.filter(
-                Show.venue_id==self.id,
-                Show.start_time < datetime.now()
-              ).all()],
-              'upcoming_shows': [x._get_show_artist_time for x in Show.query.filter(
-                Show.venue_id==self.id,
-                Show.start_time > datetime.now()
-              ).all()],
-              'past_shows_count': Show.query.filter(
-                Show.start_time < datetime.now(),
-                Show.venue_id == self.id
-              ).count(),
-              'upcoming_shows_count': Show.query.filter(
-                Show.start_time > datetime.now(),
-                Show.venue_id == self.id
-              ).count()
+              'image_link' : self.image_link
             }
+      venue.update(Show._get_timeline(Show.venue_id == self.id, Show.artist,
+                                      lambda x: x._get_show_artist_time,
+                                      past_page=past_page, past_per_page=past_per_page))
+      return venue
 
-    @property
-    def _get_upcoming_shows_count(self):
-      return {'id': self.id,
-              'name': self.name,
-              'num_upcoming_shows': Show.query.filter(
-                Show.start_time > datetime.now(),
-                Show.venue_id == self.id
-              ).count()
-            }
+    @classmethod
+    def _areas_query(cls, page=1, per_page=None, genre=None):
+      now = datetime.now()
+      criteria = [cls.id.in_(Genre._members(VenueGenre, genre))] if genre else []
+      areas = db.session.query(cls.city, cls.state).filter(*criteria).distinct().order_by(cls.state, cls.city)
+      if per_page:
+        # one extra area tells us whether there is a next page
+        areas = areas.limit(per_page + 1).offset((page - 1) * per_page)
+      areas = areas.subquery()
 
-    @property
-    def _get_venues_by_city_state(self):
-      return {'city' : self.city,
-              'state' : self.state,
-              'venues' : [x._get_upcoming_shows_count 
-                            for x in Venue.query.filter(Venue.city == self.city, Venue.state == self.state)
-                          .all()]
-              }
+      return db.session.query(cls.id, cls.name, cls.city, cls.state, db.func.count(Show.id)) \
+        .join(areas, db.and_(cls.city == areas.c.city, cls.state == areas.c.state)) \
+        .outerjoin(Show, db.and_(Show.venue_id == cls.id, Show.start_time > now)) \
+        .filter(*criteria) \
+        .group_by(cls.id, cls.name, cls.city, cls.state) \
+        .order_by(cls.state, cls.city, cls.id)
+
+    @classmethod
+    def _get_areas(cls, page=1, per_page=None, genre=None):
+      rows = cls._areas_query(page=page, per_page=per_page, genre=genre).all()
+
+      data = []
+      for (city, state), venues in groupby(rows, key=lambda row: (row.city, row.state)):
+        data.append({'city': city,
+                     'state': state,
+                     'venues': [{'id': venue_id,
+                                 'name': name,
+                                 'num_upcoming_shows': num_upcoming_shows}
+                                for venue_id, name, _, _, num_upcoming_shows in venues]
+                    })
+
+      has_next = bool(per_page) and len(data) > per_page
+      return data[:per_page] if per_page else data, has_next
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+      db.Index('ix_Artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
-    genres = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=ArtistGenre, order_by=Genre.name,
+                             passive_deletes=True)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
@@ -158,15 +332,30 @@ class Artist(db.Model):
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
     image_link = db.Column(db.String(500))
+    updated_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    version = db.Column(db.Integer, nullable=False)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
-      return f'\n<Artist: id: {self.id},\nname: {self.name},\ngenres: {self.genres},\ncity: {self.city},\nstate: {self.state},\nphone: {self.phone},\nwebsite: {self.website},\nfacebook_link: {self.facebook_link},\nseeking_venue: {self.seeking_venue},\nseeking_description: {self.seeking_description},\nimage_link: {self.image_link}>\n'
+      return f'\n<Artist: id: {self.id},\nname: {self.name},\ngenres: {self._genre_names},\ncity: {self.city},\nstate: {self.state},\nphone: {self.phone},\nwebsite: {self.website},\nfacebook_link: {self.facebook_link},\nseeking_venue: {self.seeking_venue},\nseeking_description: {self.seeking_description},\nimage_link: {self.image_link}>\n'
+
+    @property
+    def _genre_names(self):
+      return [genre.name for genre in self.genres]
+
+    def _set_genres(self, names):
+      genres = Genre._get_or_create(names)
+      if set(genres) != set(self.genres):
+        self.genres = genres
+        # link table changes alone do not bump version/updated_at, which ETags rely on
+        self.updated_at = datetime.utcnow()
 
     @property
     def serialize(self):
         return {'id': self.id,
               'name': self.name,
-              'genres': self.genres.split(','),
+              'genres': self._genre_names,
               'city': self.city,
               'state': self.state,
               'phone': self.phone,
@@ -183,21 +372,10 @@ class Artist(db.Model):
               'name': self.name
               }
 
-    @property
-    def _get_artists_by_search(self):
-      return {"id": self.id,
-              "name": self.name,
-              "num_upcoming_shows": Show.query.filter(
-                Show.start_time > datetime.now(),
-                Show.artist_id == self.id
-              ).count()
-            }
-
-    @property
-    def _get_artist_with_show_info(self):
-      return {'id': self.id,
+    def _get_artist_with_show_info(self, past_page=1, past_per_page=None):
+      artist = {'id': self.id,
               'name': self.name,
-              'genres': self.genres,
+              'genres': self._genre_names,
               'city': self.city,
               'state': self.city,
               'phone': self.phone,
@@ -205,21 +383,61 @@ class Artist(db.Model):
               'facebook_link': self.facebook_link,
               'seeking_venue': self.seeking_venue,
               'seeking_description': self.seeking_description,
-              'image_link' : self.image_link,
-              'past_shows' : [x._get_show_venue_time for x in Show.query.filter(
-                Show.artist_id==self.id,
-                Show.start_time < datetime.now()
-              ).all()],
-              'upcoming_shows': [x._get_show_venue_time for x in Show.query.filter(
-                Show.artist_id==self.id,
-                Show.start_time > datetime.now()
-              ).all()],
-              'past_shows_count': Show.query.filter(
-                Show.start_time < datetime.now(),
-                Show.artist_id == self.id
-              ).count(),
-              'upcoming_shows_count': Show.query.filter(
-                Show.start_time > datetime.now(),
-                Show.artist_id == self.id
-              ).count()
+              'image_link' : self.image_link
             }
+      artist.update(Show._get_timeline(Show.artist_id == self.id, Show.venue,
+                                       lambda x: x._get_show_venue_time,
+                                       past_page=past_page, past_per_page=past_per_page))
+      return artist
+
+#----------------------------------------------------------------------------#
+# Table versions.
+#----------------------------------------------------------------------------#
+
+# One row per table, bumped by triggers on every insert, update and delete, so
+# writes from any process (other workers, `flask import`, raw SQL) move it and
+# listings validate with a primary-key lookup instead of count()/max() over
+# the table. On Postgres the bump is per statement; writers to one table queue
+# on its row until they commit.
+
+VERSIONED_TABLES = ('Venue', 'Artist', 'Show')
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'TableVersion'
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+      return f'<TableVersion: name: {self.name}, version: {self.version}>'
+
+    @classmethod
+    def _get_versions(cls, *tables):
+      return db.session.query(cls.name, cls.version, cls.updated_at) \
+        .filter(cls.name.in_(tables)) \
+        .order_by(cls.name) \
+        .all()
+
+
+_SQLITE_VERSION_TRIGGER = 'CREATE TRIGGER "{t}_version_{suffix}" AFTER {operation} ON "{t}" BEGIN ' \
+  'UPDATE "TableVersion" SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = \'{t}\'; END'
+_PG_VERSION_FUNCTION = 'CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$ BEGIN ' \
+  'UPDATE "TableVersion" SET version = version + 1, updated_at = now() at time zone \'utc\' ' \
+  'WHERE name = TG_TABLE_NAME; RETURN NULL; END $$ LANGUAGE plpgsql'
+_PG_VERSION_TRIGGER = 'CREATE TRIGGER "{t}_version" AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "{t}" ' \
+  'FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()'
+
+event.listen(TableVersion.__table__, 'after_create',
+             DDL(_PG_VERSION_FUNCTION).execute_if(dialect='postgresql'))
+for _table in VERSIONED_TABLES:
+  event.listen(TableVersion.__table__, 'after_create',
+               DDL('INSERT INTO "TableVersion" (name, version, updated_at) '
+                   'VALUES (\'{}\', 1, CURRENT_TIMESTAMP)'.format(_table)))
+  for _suffix, _operation in (('ai', 'INSERT'), ('au', 'UPDATE'), ('ad', 'DELETE')):
+    event.listen(db.metadata.tables[_table], 'after_create',
+                 DDL(_SQLITE_VERSION_TRIGGER.format(t=_table, suffix=_suffix, operation=_operation))
+                 .execute_if(dialect='sqlite'))
+  event.listen(db.metadata.tables[_table], 'after_create',
+               DDL(_PG_VERSION_TRIGGER.format(t=_table)).execute_if(dialect='postgresql'))
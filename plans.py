@@ -0,0 +1,103 @@
+import re
+from itertools import takewhile
+import click
+from datetime import datetime
+from flask.cli import with_appcontext
+from models import db, Venue, Artist, Show
+from search import _search_query, show_search_criteria
+from bookings import _conflict_query
+
+#----------------------------------------------------------------------------#
+# Query plan checks.
+#----------------------------------------------------------------------------#
+
+# The hot queries behind the listing, detail, feed and search pages. Each one
+# is EXPLAINed and must reach Show through an index range, never a full scan
+# of the table or of an index.
+def _hot_queries():
+  now = datetime.now()
+  return [
+    ('venue upcoming shows', Show._timeline_query(Show.venue_id == 1, Show.artist, now)),
+    ('venue past shows page', Show._timeline_query(Show.venue_id == 1, Show.artist, now, past=True).limit(30)),
+    ('artist upcoming shows', Show._timeline_query(Show.artist_id == 1, Show.venue, now)),
+    ('artist past shows page', Show._timeline_query(Show.artist_id == 1, Show.venue, now, past=True).limit(30)),
+    ('shows feed', Show._shows_page_query(after=(now, 1), limit=60)),
+    ('shows feed date window', Show._shows_page_query(start=now, end=now, limit=60)),
+    ('venue booking check', _conflict_query('venue', 1, now, now)),
+    ('artist booking check', _conflict_query('artist', 1, now, now)),
+    ('venue areas', Venue._areas_query(per_page=100)),
+    ('venue search', _search_query(Venue, 'the', limit=50)),
+    ('artist search', _search_query(Artist, 'the', limit=50)),
+    ('show search by venue', Show._shows_page_query(limit=60, criteria=show_search_criteria(venue='the'))),
+    ('show search by area', Show._shows_page_query(start=now, limit=60,
+                                                  criteria=show_search_criteria(city='x', state='CA'))),
+  ]
+
+# any full walk of Show, through the table or through one of its indexes
+_SEQ_SCAN = {
+  'sqlite': re.compile(r'^SCAN (TABLE )?"?Show"?(_\d+)?( |$)'),
+  'postgresql': re.compile(r'Seq Scan on "?Show"?( |$)'),
+}
+# ...which on Postgres is also an index scan that has no Index Cond to bound it
+_PG_INDEX_SCAN = re.compile(r'Index (Only )?Scan (Backward )?using \S+ on "?Show"?( |$)')
+
+
+def _scans_show(dialect, plan):
+  lines = [line.strip() for line in plan]
+  if any(_SEQ_SCAN[dialect].search(line) for line in lines):
+    return True
+  if dialect == 'postgresql':
+    for i, line in enumerate(lines):
+      if _PG_INDEX_SCAN.search(line):
+        # a node's details run up to the next node
+        details = takewhile(lambda detail: not detail.startswith('->'), lines[i + 1:])
+        if not any(detail.startswith('Index Cond:') for detail in details):
+          return True
+  return False
+
+
+def explain(query):
+  connection = db.session.connection()
+  dialect = connection.dialect
+  compiled = query.statement.compile(dialect=dialect)
+  params = compiled.construct_params()
+  if dialect.positional:
+    params = tuple(params[name] for name in compiled.positiontup)
+
+  if dialect.name == 'sqlite':
+    return [row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)]
+  if dialect.name == 'postgresql':
+    # the tables are tiny outside production, so only fall back to a seq scan
+    # when no index can answer the query at all
+    connection.execute('SET LOCAL enable_seqscan = off')
+  return [row[0] for row in connection.execute('EXPLAIN ' + str(compiled), params)]
+
+
+def find_seq_scans():
+  dialect = db.engine.dialect.name
+  if dialect not in _SEQ_SCAN:
+    raise click.ClickException('No plan checks for the {} dialect.'.format(dialect))
+
+  failures = {}
+  try:
+    for name, query in _hot_queries():
+      plan = explain(query)
+      if _scans_show(dialect, plan):
+        failures[name] = plan
+  finally:
+    db.session.rollback()
+  return failures
+
+
+@click.command('check-plans')
+@with_appcontext
+def check_plans():
+  """Fail when a hot query falls back to a full scan of Show."""
+  failures = find_seq_scans()
+  for name, plan in failures.items():
+    click.echo('{}: full scan of Show'.format(name), err=True)
+    for line in plan:
+      click.echo('    ' + line, err=True)
+  if failures:
+    raise click.ClickException('{} hot queries scan Show.'.format(len(failures)))
+  click.echo('All hot queries use an index on Show.')
@@ -0,0 +1,176 @@
+import cProfile
+import json
+import os
+import pstats
+import re
+import time
+from datetime import datetime
+import click
+from flask import Blueprint, abort, current_app, g, render_template, request, send_from_directory
+from flask.cli import with_appcontext
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from config import fallback_secret_key
+
+#----------------------------------------------------------------------------#
+# On-demand request profiling.
+#----------------------------------------------------------------------------#
+
+# A request carrying a valid token (X-Profile-Token header, or ?profile_token=)
+# runs under cProfile with its SQL statements timed, and skips the page cache
+# and 304s so the full render is measured. The profile (.prof, for pstats or
+# snakeviz) and a JSON summary with the SQL timeline are written to
+# PROFILE_DIR, which keeps the newest PROFILE_KEEP of them. Other requests
+# only pay for looking the token up. Tokens come from `flask profile-token`
+# and also open the /admin/profiles listing.
+
+profiles = Blueprint('profiles', __name__, url_prefix='/admin/profiles')
+
+_NAME = re.compile(r'^\d{8}T\d{12}-[\w.-]+\.(prof|json)$')
+_TOP_FUNCTIONS = 30
+
+
+def _serializer():
+  return URLSafeTimedSerializer(current_app.secret_key, salt='fyyur-profile')
+
+
+def _token():
+  return request.headers.get('X-Profile-Token') or request.args.get('profile_token')
+
+
+def _authorized(token):
+  try:
+    _serializer().loads(token, max_age=current_app.config['PROFILE_TOKEN_MAX_AGE'])
+  except BadSignature:
+    return False
+  return True
+
+
+class SqlTimeline(object):
+
+    def __init__(self):
+      self.start = time.perf_counter()
+      self.statements = []
+
+    def record(self, statement, duration):
+      offset = time.perf_counter() - duration - self.start
+      self.statements.append({'offset_ms': round(offset * 1000, 3),
+                              'duration_ms': round(duration * 1000, 3),
+                              'statement': ' '.join(statement.split())})
+
+
+def _top_functions(profiler):
+  stats = pstats.Stats(profiler).stats
+  rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:_TOP_FUNCTIONS]
+  return [{'function': pstats.func_std_string(function), 'calls': calls,
+           'tottime_ms': round(tottime * 1000, 3), 'cumtime_ms': round(cumtime * 1000, 3)}
+          for function, (_, calls, tottime, cumtime, _) in rows]
+
+
+def _rotate(directory, keep):
+  names = sorted(name for name in os.listdir(directory) if _NAME.match(name) and name.endswith('.prof'))
+  for name in names[:max(len(names) - keep, 0)]:
+    for path in (name, name[:-len('.prof')] + '.json'):
+      try:
+        os.remove(os.path.join(directory, path))
+      except FileNotFoundError:
+        pass
+
+
+def _save(profiler, timeline, duration, response):
+  directory = current_app.config['PROFILE_DIR']
+  os.makedirs(directory, exist_ok=True)
+  now = datetime.utcnow()
+  base = '{:%Y%m%dT%H%M%S%f}-{}-{}'.format(now, g.get('request_id', 'none')[:12], request.endpoint or 'unmatched')
+  profiler.dump_stats(os.path.join(directory, base + '.prof'))
+  summary = {'time': now.isoformat(),
+             'method': request.method,
+             'path': request.path,
+             'args': {key: value for key, value in request.args.items(multi=True) if key != 'profile_token'},
+             'status': response.status_code,
+             'duration_ms': round(duration * 1000, 3),
+             'sql_count': len(timeline.statements),
+             'sql_ms': round(sum(statement['duration_ms'] for statement in timeline.statements), 3),
+             'sql': timeline.statements,
+             'functions': _top_functions(profiler)}
+  with open(os.path.join(directory, base + '.json'), 'w') as f:
+    json.dump(summary, f, indent=1)
+  _rotate(directory, current_app.config['PROFILE_KEEP'])
+  return base
+
+
+def init_profiling(app):
+  if not app.config.get('PROFILING_ENABLED', True):
+    return
+
+  @app.before_request
+  def start_profile():
+    token = _token()
+    if token is None or request.blueprint == 'profiles' or not _authorized(token):
+      return
+    profiler = cProfile.Profile()
+    try:
+      profiler.enable()
+    except ValueError:
+      # another profiler is already running in this process
+      return
+    g.profiling = True
+    g.sql_timeline = SqlTimeline()
+    g.profiler = profiler
+
+  @app.after_request
+  def save_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+      return response
+    profiler.disable()
+    timeline = g.pop('sql_timeline')
+    base = _save(profiler, timeline, time.perf_counter() - timeline.start, response)
+    response.headers['X-Profile'] = base
+    return response
+
+  @app.teardown_request
+  def stop_profile(exc):
+    # after_request is skipped when the view raises
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+      profiler.disable()
+
+  app.register_blueprint(profiles)
+  app.cli.add_command(profile_token)
+
+
+@profiles.route('')
+def list_profiles():
+  token = _token()
+  if token is None or not _authorized(token):
+    abort(404)
+  directory = current_app.config['PROFILE_DIR']
+  entries = []
+  names = sorted(os.listdir(directory), reverse=True) if os.path.isdir(directory) else []
+  for name in names:
+    if _NAME.match(name) and name.endswith('.json'):
+      with open(os.path.join(directory, name)) as f:
+        summary = json.load(f)
+      entries.append(dict(summary, name=name[:-len('.json')]))
+  return render_template('pages/profiles.html', profiles=entries, token=token)
+
+
+@profiles.route('/<name>')
+def download_profile(name):
+  token = _token()
+  if token is None or not _authorized(token) or not _NAME.match(name):
+    abort(404)
+  return send_from_directory(current_app.config['PROFILE_DIR'], name, as_attachment=True)
+
+
+@click.command('profile-token')
+@with_appcontext
+def profile_token():
+  """Print a token that profiles requests and opens /admin/profiles."""
+  if current_app.secret_key == fallback_secret_key:
+    # a key drawn per process would sign a token no server process accepts
+    raise click.ClickException('SECRET_KEY is not configured; set it to the key the '
+                               'servers use before creating a profile token.')
+  click.echo(_serializer().dumps('profile'))
+  click.echo('Valid for {} seconds; send it as the X-Profile-Token header.'.format(
+    current_app.config['PROFILE_TOKEN_MAX_AGE']), err=True)
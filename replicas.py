@@ -0,0 +1,41 @@
+import random
+import time
+from flask import g, has_request_context, request, session
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db
+
+#----------------------------------------------------------------------------#
+# Read replicas.
+#----------------------------------------------------------------------------#
+
+# GET/HEAD requests read from a random replica bind. Any request that writes
+# pins the client to the primary for REPLICA_LAG_WINDOW seconds, so the
+# redirect after e.g. edit_venue_submission still sees its own write.
+
+def init_replicas(app):
+  names = app.config.get('SQLALCHEMY_READ_REPLICAS')
+  if not names:
+    return
+
+  @app.before_request
+  def route_reads_to_replica():
+    if request.method not in ('GET', 'HEAD'):
+      return
+    if session.get('_read_primary_until', 0) >= time.time():
+      # also keeps the page cache, which replica reads may fill, out of the way
+      g.read_your_writes = True
+    else:
+      g.read_replica = db.get_engine(app, bind=random.choice(names))
+
+  @app.after_request
+  def pin_writers_to_primary(response):
+    if g.pop('wrote_to_primary', False):
+      session['_read_primary_until'] = time.time() + app.config['REPLICA_LAG_WINDOW']
+    return response
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_write(session, flush_context):
+  if has_request_context():
+    g.wrote_to_primary = True
@@ -0,0 +1,207 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from flask import current_app, g
+from sqlalchemy import DDL, event, text
+from models import db, Venue, Artist, Show, Genre, ArtistGenre
+
+#----------------------------------------------------------------------------#
+# Name search.
+#----------------------------------------------------------------------------#
+
+# Postgres answers the substring match from the pg_trgm GIN index declared on
+# the models. SQLite (local and test runs) gets an FTS5 trigram table per model,
+# kept in sync by triggers, which serves the same LIKE '%term%' lookups.
+
+def _sqlite_trigram_ddl(table):
+  fts = '"{}_name_trgm"'.format(table)
+  return [
+    'CREATE VIRTUAL TABLE {fts} USING fts5('
+    'name, content=\'{t}\', content_rowid=\'id\', tokenize=\'trigram\')',
+    'CREATE TRIGGER "{t}_name_trgm_ai" AFTER INSERT ON "{t}" BEGIN '
+    'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END',
+    'CREATE TRIGGER "{t}_name_trgm_ad" AFTER DELETE ON "{t}" BEGIN '
+    'INSERT INTO {fts}({fts}, rowid, name) VALUES (\'delete\', old.id, old.name); END',
+    'CREATE TRIGGER "{t}_name_trgm_au" AFTER UPDATE OF name ON "{t}" BEGIN '
+    'INSERT INTO {fts}({fts}, rowid, name) VALUES (\'delete\', old.id, old.name); '
+    'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END',
+  ], fts
+
+
+for model in (Venue, Artist):
+  statements, fts = _sqlite_trigram_ddl(model.__tablename__)
+  for statement in statements:
+    event.listen(model.__table__, 'after_create',
+                 DDL(statement.format(t=model.__tablename__, fts=fts)).execute_if(dialect='sqlite'))
+  event.listen(model.__table__, 'before_drop',
+               DDL('DROP TABLE IF EXISTS {}'.format(fts)).execute_if(dialect='sqlite'))
+
+event.listen(db.metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
+_SHOW_FOREIGN_KEYS = {Venue: Show.venue_id, Artist: Show.artist_id}
+
+def _name_match(model, term):
+  # the substring criterion for the index this dialect has, and its ranking
+  pattern = '%' + term + '%'
+  if db.engine.dialect.name == 'sqlite':
+    matches = text('SELECT rowid FROM "{}_name_trgm" WHERE name LIKE :pattern'.format(model.__tablename__)) \
+      .bindparams(pattern=pattern)
+    return model.id.in_(matches), \
+      [db.func.instr(db.func.lower(model.name), term.lower()), db.func.length(model.name)]
+  if db.engine.dialect.name == 'postgresql':
+    return model.name.ilike(pattern), [db.func.similarity(model.name, term).desc()]
+  return model.name.ilike(pattern), []
+
+
+def _search_query(model, term, limit=None):
+  # upcoming show counts come from one grouped subquery, restricted to the
+  # capped hit list so it reads only their (venue_id|artist_id, start_time) ranges
+  show_fk = _SHOW_FOREIGN_KEYS[model]
+  match, rank = _name_match(model, term)
+  hits = db.session.query(model.id).filter(match).order_by(*(rank + [model.id]))
+  if limit:
+    hits = hits.limit(limit)
+  hits = hits.subquery()
+  upcoming = db.session.query(show_fk.label('id'), db.func.count(Show.id).label('num_upcoming_shows')) \
+    .filter(show_fk.in_(db.session.query(hits.c.id)), Show.start_time > datetime.now()) \
+    .group_by(show_fk) \
+    .subquery()
+
+  query = db.session.query(model.id, model.name, db.func.coalesce(upcoming.c.num_upcoming_shows, 0)) \
+    .outerjoin(upcoming, upcoming.c.id == model.id) \
+    .filter(match) \
+    .order_by(*(rank + [model.id]))
+  if limit:
+    query = query.limit(limit)
+  return query
+
+
+def search_by_name(model, term, limit=None):
+  query = _search_query(model, term, limit=limit)
+  return [{'id': id,
+           'name': name,
+           'num_upcoming_shows': num_upcoming_shows}
+          for id, name, num_upcoming_shows in query.all()]
+
+
+def _show_search_query(term, limit=None):
+  # upcoming shows whose venue or artist matches, soonest first
+  venue_match, _ = _name_match(Venue, term)
+  artist_match, _ = _name_match(Artist, term)
+  query = db.session.query(Show.id, Show.start_time, Show.venue_id, Venue.name,
+                           Show.artist_id, Artist.name, Artist.image_link) \
+    .join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id) \
+    .filter(db.or_(venue_match, artist_match), Show.start_time > datetime.now()) \
+    .order_by(Show.start_time, Show.id)
+  if limit:
+    query = query.limit(limit)
+  return query
+
+
+def search_shows_by_name(term, limit=None):
+  return [{'venue_id': venue_id,
+           'venue_name': venue_name,
+           'artist_id': artist_id,
+           'artist_name': artist_name,
+           'artist_image_link': artist_image_link,
+           'start_time': start_time}
+          for _, start_time, venue_id, venue_name, artist_id, artist_name, artist_image_link
+          in _show_search_query(term, limit=limit).all()]
+
+SHOW_SEARCH_FILTERS = ('artist', 'venue', 'city', 'state', 'genre')
+
+def show_search_criteria(artist=None, venue=None, city=None, state=None, genre=None):
+  # each filter narrows the joined Show/Venue/Artist query of Show._shows_page_query;
+  # the trigram indexes serve the names, ix_Venue_state_city the location and
+  # the ArtistGenre index the genre
+  criteria = []
+  if artist:
+    criteria.append(_name_match(Artist, artist)[0])
+  if venue:
+    criteria.append(_name_match(Venue, venue)[0])
+  if city:
+    criteria.append(Venue.city == city)
+  if state:
+    criteria.append(Venue.state == state)
+  if genre:
+    criteria.append(Artist.id.in_(Genre._members(ArtistGenre, genre)))
+  return criteria
+
+
+def search_shows(filters, after=None, limit=None, start=None, end=None):
+  return Show._get_shows_page(after=after, limit=limit, start=start, end=end,
+                              criteria=show_search_criteria(**filters))
+
+#----------------------------------------------------------------------------#
+# Unified search.
+#----------------------------------------------------------------------------#
+
+_executor = None
+
+
+def _get_executor(app):
+  global _executor
+  if _executor is None:
+    _executor = ThreadPoolExecutor(max_workers=app.config['SEARCH_WORKERS'], thread_name_prefix='search')
+  return _executor
+
+
+def _run(app, read_replica, collectors, budget, search, *args):
+  # each sub-search gets its own app context, hence its own session and connection;
+  # the request's SQL collectors are carried over so its statements still count
+  with app.app_context():
+    g.read_replica = read_replica
+    for name, collector in collectors.items():
+      setattr(g, name, collector)
+    if db.engine.dialect.name == 'postgresql':
+      # stop the statement server-side once the caller has stopped waiting
+      db.session.execute('SET LOCAL statement_timeout = {:d}'.format(int(budget * 1000)))
+    return search(*args)
+
+
+_UNRANKED = 1 << 30
+
+def _rank(term, *names):
+  # where the term first appears, then the shortest name: the order search_by_name
+  # uses on SQLite, computed here so venues, artists and shows compare on one scale
+  term = term.lower()
+  positions = [(name.lower().find(term), len(name)) for name in names if name]
+  positions = [position for position in positions if position[0] >= 0]
+  return min(positions) if positions else (_UNRANKED, 0)
+
+
+def _merge(term, sections):
+  ranked = []
+  for order, (kind, data) in enumerate(sections):
+    for position, item in enumerate(data):
+      names = (item['venue_name'], item['artist_name']) if kind == 'show' else (item['name'],)
+      ranked.append(((_rank(term, *names), order, position), dict(item, type=kind)))
+  ranked.sort(key=lambda entry: entry[0])
+  return [item for _, item in ranked]
+
+
+def search_all(term, limit=None, budget=1.0):
+  app = current_app._get_current_object()
+  executor = _get_executor(app)
+  read_replica = g.get('read_replica')
+  collectors = {name: g.get(name) for name in ('sql_stats', 'sql_timeline') if name in g}
+  searches = (('venue', search_by_name, Venue, term, limit),
+              ('artist', search_by_name, Artist, term, limit),
+              ('show', search_shows_by_name, term, limit))
+  futures = [(kind, executor.submit(_run, app, read_replica, collectors, budget, search, *args))
+             for kind, search, *args in searches]
+  done, _ = wait([future for _, future in futures], timeout=budget)
+
+  timed_out, sections = [], []
+  for kind, future in futures:
+    if future not in done:
+      timed_out.append(kind + 's')
+    elif future.exception() is not None:
+      app.logger.warning('%s search for %r failed: %s', kind, term, future.exception())
+      timed_out.append(kind + 's')
+    else:
+      sections.append((kind, future.result()))
+  data = _merge(term, sections)
+  return {'count': len(data), 'data': data, 'timed_out': timed_out}
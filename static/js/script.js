@@ -2,3 +2,33 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Suggest venue/artist names from /autocomplete into a datalist
+document.querySelectorAll('input[data-autocomplete]').forEach(function (input, n) {
+  var list = document.createElement('datalist');
+  var timer, last;
+  list.id = 'autocomplete-' + n;
+  input.setAttribute('list', list.id);
+  input.parentNode.appendChild(list);
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      var q = input.value.trim();
+      if (!q || q === last) return;
+      last = q;
+      var url = '/autocomplete?q=' + encodeURIComponent(q);
+      if (input.dataset.autocomplete) url += '&kind=' + input.dataset.autocomplete;
+      fetch(url).then(function (response) {
+        return response.json();
+      }).then(function (results) {
+        if (q !== last) return;
+        list.innerHTML = '';
+        results.forEach(function (result) {
+          var option = document.createElement('option');
+          option.value = result.name;
+          list.appendChild(option);
+        });
+      });
+    }, 150);
+  });
+});
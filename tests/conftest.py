@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# config.py reads these at import time
+_DB_PATH = os.path.join(tempfile.mkdtemp(), 'fyyur-test.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + _DB_PATH
+os.environ.setdefault('SECRET_KEY', 'test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as fyyur_app
+from models import db
+from cache import cache
+import typeahead
+
+
+@pytest.fixture
+def app():
+  fyyur_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+  with fyyur_app.app_context():
+    db.create_all()
+  yield fyyur_app
+  with fyyur_app.app_context():
+    db.session.remove()
+    db.drop_all()
+  if cache.backend is not None:
+    cache.backend.clear()
+  typeahead.index.mark_stale()
+
+
+@pytest.fixture
+def client(app):
+  return app.test_client()
+
+
+@pytest.fixture
+def db_path():
+  return _DB_PATH
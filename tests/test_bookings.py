@@ -0,0 +1,72 @@
+import sqlite3
+from datetime import datetime
+from models import db, Venue, Artist, Show
+from bookings import _conflict_query
+from plans import explain
+
+
+def _seed(app):
+  with app.app_context():
+    db.session.add_all([Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street'),
+                        Artist(name='Guns N Petals', city='San Francisco', state='CA'),
+                        Artist(name='Matt Quevedo', city='New York', state='NY')])
+    db.session.commit()
+
+
+def _book(client, artist_id, start, end):
+  return client.post('/shows/create', data={'artist_id': artist_id, 'venue_id': 1,
+                                            'start_time': start, 'end_time': end})
+
+
+def _shows(app):
+  with app.app_context():
+    return Show.query.count()
+
+
+def test_overlapping_show_is_rejected(app, client):
+  _seed(app)
+  assert _book(client, 1, '2031-02-01 20:00:00', '2031-02-01 23:00:00').status_code == 200
+  response = _book(client, 2, '2031-02-01 20:30:00', '2031-02-01 23:30:00')
+  assert response.status_code == 409
+  assert b'already booked' in response.data
+  assert _shows(app) == 1
+
+
+def test_adjacent_show_is_accepted(app, client):
+  _seed(app)
+  assert _book(client, 1, '2031-02-01 20:00:00', '2031-02-01 23:00:00').status_code == 200
+  assert _book(client, 2, '2031-02-01 23:00:00', '2031-02-02 01:00:00').status_code == 200
+  assert _shows(app) == 2
+
+
+def test_show_booked_by_another_process_is_seen(app, client, db_path):
+  _seed(app)
+  # warm this process up on the venue first, then write behind its back
+  assert _book(client, 1, '2031-01-01 20:00:00', '2031-01-01 23:00:00').status_code == 200
+  other = sqlite3.connect(db_path)
+  with other:
+    other.execute('INSERT INTO "Show" (venue_id, artist_id, start_time, end_time, updated_at, version) VALUES (1, 1, ?, ?, ?, 1)',
+                  (str(datetime(2031, 2, 1, 20)), str(datetime(2031, 2, 1, 23)), str(datetime.utcnow())))
+  other.close()
+
+  assert _book(client, 2, '2031-02-01 20:30:00', '2031-02-01 23:30:00').status_code == 409
+  assert _shows(app) == 2
+
+
+def test_show_must_end_after_it_starts(app, client):
+  _seed(app)
+  assert _book(client, 1, '2031-02-01 20:00:00', '2031-02-01 19:00:00').status_code == 400
+  assert _shows(app) == 0
+
+
+def test_overlong_show_is_rejected(app, client):
+  _seed(app)
+  assert _book(client, 1, '2031-02-01 20:00:00', '2031-02-03 20:00:00').status_code == 400
+  assert _shows(app) == 0
+
+
+def test_conflict_lookup_reads_a_bounded_index_range(app):
+  with app.test_request_context():
+    plan = explain(_conflict_query('venue', 1, datetime(2031, 2, 1, 20), datetime(2031, 2, 1, 23)))
+  assert any('ix_Show_venue_id_start_time (venue_id=? AND start_time>? AND start_time<?)' in line
+             for line in plan), plan
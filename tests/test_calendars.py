@@ -0,0 +1,66 @@
+import sqlite3
+from datetime import date, datetime
+import pytest
+import app as app_module
+from models import db, Venue, Artist
+
+
+class _NextMonth(date):
+
+    @classmethod
+    def today(cls):
+      today = date.today()
+      return today.replace(year=today.year + today.month // 12, month=today.month % 12 + 1, day=1)
+
+
+def _seed(app):
+  with app.app_context():
+    db.session.add(Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street'))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('url', ['/venues/1/calendar', '/venues/1/calendar?view=week', '/venues/1/calendar.ics'])
+def test_default_period_follows_today(app, client, monkeypatch, url):
+  _seed(app)
+  first = client.get(url)
+  assert client.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+  monkeypatch.setattr(app_module, 'date', _NextMonth)
+  response = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+  assert response.status_code == 200
+  assert response.headers['ETag'] != first.headers['ETag']
+
+
+def test_explicit_month_does_not_depend_on_today(app, client, monkeypatch):
+  _seed(app)
+  first = client.get('/venues/1/calendar?month=2031-02')
+  monkeypatch.setattr(app_module, 'date', _NextMonth)
+  assert client.get('/venues/1/calendar?month=2031-02',
+                    headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+
+@pytest.mark.parametrize('query', ['month=9999-12', 'month=0001-01', 'view=week&day=0001-01-02',
+                                   'view=week&day=9999-12-31'])
+def test_out_of_range_periods_are_rejected(app, client, query):
+  _seed(app)
+  assert client.get('/venues/1/calendar?' + query).status_code == 400
+
+
+def test_show_written_by_another_process_is_listed(app, client, db_path):
+  _seed(app)
+  first = client.get('/venues/1/calendar?month=2031-02')
+  with app.app_context():
+    db.session.add(Artist(name='Guns N Petals', city='San Francisco', state='CA'))
+    db.session.commit()
+  client.get('/venues/1/calendar?month=2031-02')
+  # another worker's booking: this process's cache versions do not move
+  other = sqlite3.connect(db_path)
+  with other:
+    other.execute('INSERT INTO "Show" (venue_id, artist_id, start_time, end_time, updated_at, version) VALUES (1, 1, ?, ?, ?, 1)',
+                  (str(datetime(2031, 2, 14, 20)), str(datetime(2031, 2, 14, 23)), str(datetime.utcnow())))
+  other.close()
+
+  for url in ('/venues/1/calendar?month=2031-02', '/venues/1/calendar?view=week&day=2031-02-14'):
+    response = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert b'Guns N Petals' in response.data
@@ -0,0 +1,57 @@
+import sqlite3
+from models import db, Venue
+
+
+def _seed(app):
+  with app.app_context():
+    db.session.add(Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street'))
+    db.session.commit()
+
+
+def test_not_modified_until_the_venue_changes(app, client):
+  _seed(app)
+  first = client.get('/venues/1')
+  assert first.status_code == 200 and first.headers['ETag']
+  assert client.get('/venues/1', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+  with app.app_context():
+    Venue.query.get(1).name = 'The Musical Hop Annex'
+    db.session.commit()
+  response = client.get('/venues/1', headers={'If-None-Match': first.headers['ETag']})
+  assert response.status_code == 200
+  assert b'The Musical Hop Annex' in response.data
+
+
+def test_cached_page_is_not_sent_under_a_newer_etag(app, client, db_path):
+  _seed(app)
+  first = client.get('/venues/1')
+  # another worker's commit: this process's page cache versions do not move
+  other = sqlite3.connect(db_path)
+  with other:
+    other.execute('UPDATE "Venue" SET name = ?, version = version + 1, updated_at = ? WHERE id = 1',
+                  ('Renamed Hall', '2031-01-01 00:00:00'))
+  other.close()
+
+  response = client.get('/venues/1')
+  assert response.headers['ETag'] != first.headers['ETag']
+  assert b'Renamed Hall' in response.data
+
+
+def test_listing_etag_follows_writes_from_other_processes(app, client, db_path):
+  _seed(app)
+  first = client.get('/venues')
+  assert client.get('/venues', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+  other = sqlite3.connect(db_path)
+  with other:
+    other.execute('DELETE FROM "Venue" WHERE id = 1')
+  other.close()
+
+  response = client.get('/venues', headers={'If-None-Match': first.headers['ETag']})
+  assert response.status_code == 200
+  assert b'The Musical Hop' not in response.data
+
+
+def test_unknown_entities_are_not_found(app, client):
+  _seed(app)
+  for url in ('/venues/99999', '/artists/99999'):
+    assert client.get(url).status_code == 404
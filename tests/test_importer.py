@@ -0,0 +1,81 @@
+from models import db, Venue, Artist, Show, TableVersion
+from importer import import_rows
+
+VENUES = [{'name': 'The Musical Hop', 'city': 'San Francisco', 'state': 'CA', 'address': '1015 Folsom Street',
+           'genres': 'Jazz,Reggae'},
+          {'name': 'Park Square Live Music & Coffee', 'city': 'San Francisco', 'state': 'CA',
+           'address': '34 Whiskey Moore Ave', 'genres': 'Rock n Roll'}]
+
+
+def _import(app, model, rows):
+  with app.app_context():
+    return import_rows(model, [dict(row) for row in rows])
+
+
+def _versions(app, model):
+  with app.app_context():
+    return {name: (version, updated_at) for name, version, updated_at in
+            db.session.query(model.name, model.version, model.updated_at)}
+
+
+def _table_version(app, model):
+  with app.app_context():
+    return TableVersion._get_versions(model.__tablename__)
+
+
+def test_reimport_of_unchanged_rows_writes_nothing(app):
+  assert _import(app, Venue, VENUES)['inserted'] == 2
+  before, table_before = _versions(app, Venue), _table_version(app, Venue)
+
+  stats = _import(app, Venue, VENUES)
+  assert (stats['inserted'], stats['updated'], stats['unchanged'], stats['relinked']) == (0, 0, 2, 0)
+  assert _versions(app, Venue) == before
+  assert _table_version(app, Venue) == table_before
+
+
+def test_only_changed_rows_are_updated(app):
+  _import(app, Venue, VENUES)
+  changed = [dict(VENUES[0], address='1016 Folsom Street'), dict(VENUES[1], genres='Rock n Roll,Jazz')]
+  stats = _import(app, Venue, changed)
+  assert (stats['updated'], stats['unchanged'], stats['relinked']) == (1, 1, 1)
+
+  versions = _versions(app, Venue)
+  assert versions['The Musical Hop'][0] == 2
+  assert versions['Park Square Live Music & Coffee'][0] == 2
+  with app.app_context():
+    assert Venue.query.filter_by(name='Park Square Live Music & Coffee').one()._genre_names == ['Jazz', 'Rock n Roll']
+
+
+def test_shows_resolve_venue_and_artist_names(app):
+  _import(app, Venue, VENUES)
+  _import(app, Artist, [{'name': 'Guns N Petals', 'city': 'San Francisco', 'state': 'CA'},
+                        {'name': 'Guns N Petals', 'city': 'New York', 'state': 'NY'}])
+  stats = _import(app, Show, [{'venue_name': 'The Musical Hop', 'artist_name': 'Guns N Petals',
+                               'start_time': '2031-02-01T20:00:00'},
+                              {'venue_name': 'Nowhere', 'artist_name': 'Guns N Petals',
+                               'start_time': '2031-02-02T20:00:00'}])
+  assert (stats['inserted'], stats['rejected']) == (1, 1)
+  with app.app_context():
+    show = Show.query.one()
+    # a shared name resolves to the oldest row
+    assert (show.venue.name, show.artist.city) == ('The Musical Hop', 'San Francisco')
+
+
+def test_double_bookings_are_rejected(app):
+  _import(app, Venue, VENUES)
+  _import(app, Artist, [{'name': 'Guns N Petals', 'city': 'San Francisco', 'state': 'CA'},
+                        {'name': 'Matt Quevedo', 'city': 'New York', 'state': 'NY'}])
+  booked = {'venue_id': '1', 'artist_id': '1', 'start_time': '2031-02-01T20:00:00', 'end_time': '2031-02-01T23:00:00'}
+  assert _import(app, Show, [booked])['inserted'] == 1
+
+  stats = _import(app, Show, [
+    booked,
+    # the venue is taken at 21:00, by the show already in the database
+    {'venue_id': '1', 'artist_id': '2', 'start_time': '2031-02-01T21:00:00'},
+    # and the artist by the first of these two
+    {'venue_id': '2', 'artist_id': '2', 'start_time': '2031-02-03T20:00:00'},
+    {'venue_id': '1', 'artist_id': '2', 'start_time': '2031-02-03T22:00:00'},
+  ])
+  assert (stats['inserted'], stats['unchanged'], stats['conflicts']) == (1, 1, 2)
+  with app.app_context():
+    assert Show.query.count() == 2
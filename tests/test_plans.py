@@ -0,0 +1,7 @@
+from plans import find_seq_scans
+
+
+def test_hot_queries_use_an_index_on_show(app):
+  # the schema is the create_all one; `flask check-plans` runs the same check on a migrated database
+  with app.app_context():
+    assert find_seq_scans() == {}
@@ -0,0 +1,18 @@
+import config
+from profiling import profile_token
+
+
+def test_token_needs_a_configured_secret_key(app, monkeypatch):
+  monkeypatch.setitem(app.config, 'SECRET_KEY', config.fallback_secret_key)
+  result = app.test_cli_runner().invoke(profile_token)
+  assert result.exit_code != 0
+  assert 'SECRET_KEY is not configured' in result.output
+
+
+def test_token_profiles_a_request(app, client, monkeypatch, tmp_path):
+  monkeypatch.setitem(app.config, 'PROFILE_DIR', str(tmp_path))
+  result = app.test_cli_runner(mix_stderr=False).invoke(profile_token)
+  assert result.exit_code == 0
+  response = client.get('/venues', headers={'X-Profile-Token': result.stdout.strip()})
+  assert response.status_code == 200
+  assert (tmp_path / (response.headers['X-Profile'] + '.json')).exists()
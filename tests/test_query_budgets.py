@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+import pytest
+from instrumentation import assert_max_queries
+from models import db, Venue, Artist, Show
+
+# statements per uncached render; none of them may grow with the rows on the page
+BUDGETS = [('/venues', 4),
+           ('/artists', 2),
+           ('/shows', 2),
+           ('/venues/1', 8),
+           ('/artists/1', 8),
+           ('/api/v1/shows', 1)]
+
+
+def _seed(app, count=5):
+  with app.app_context():
+    venues = [Venue(name='Venue {}'.format(i), city='City {}'.format(i % 2), state='CA', address='{} Main Street'.format(i))
+              for i in range(count)]
+    artists = [Artist(name='Artist {}'.format(i), city='City', state='CA') for i in range(count)]
+    db.session.add_all(venues + artists)
+    db.session.flush()
+    for i, (venue, artist) in enumerate(zip(venues, artists)):
+      for other in artists:
+        for days in (-10 * (i + 1), 10 * (i + 1)):
+          start = datetime.now() + timedelta(days=days, hours=artist.id)
+          db.session.add(Show(venue_id=venue.id, artist_id=other.id, start_time=start, end_time=start + timedelta(minutes=30)))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('path,budget', BUDGETS)
+def test_query_budget(app, client, path, budget):
+  _seed(app)
+  # one-off work (e.g. the typeahead preload) belongs to the first request
+  client.get('/')
+  with assert_max_queries(budget):
+    response = client.get(path)
+  assert response.status_code == 200
+
+
+def test_artists_budget_does_not_grow_with_the_catalog(app, client):
+  # more artists than one selectin batch (500 ids) of genres would cover
+  with app.app_context():
+    db.session.execute(Artist.__table__.insert(),
+                       [{'name': 'Artist {}'.format(i), 'city': 'City', 'state': 'CA', 'version': 1} for i in range(1200)])
+    db.session.commit()
+  client.get('/')
+  with assert_max_queries(2):
+    assert client.get('/artists').status_code == 200
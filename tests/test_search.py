@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+from models import db, Venue, Artist, Show
+
+
+def _seed(app):
+  with app.app_context():
+    hall = Venue(name='Rock Hall', city='San Francisco', state='CA', address='1015 Folsom Street')
+    band = Artist(name='Rockers', city='San Francisco', state='CA')
+    db.session.add_all([hall, band, Venue(name='The Old Rock Barn', city='Austin', state='TX', address='1 Main Street')])
+    db.session.flush()
+    start = datetime.now() + timedelta(days=7)
+    db.session.add(Show(venue_id=hall.id, artist_id=band.id, start_time=start, end_time=start + timedelta(hours=2)))
+    db.session.commit()
+
+
+def test_results_are_merged_by_rank(app, client):
+  _seed(app)
+  response = client.get('/search?search_term=rock')
+  assert response.status_code == 200
+  body = response.data.decode()
+  assert 'search results for "rock": 4' in body
+  # shorter names with the term up front first; a show ranks by its better name
+  positions = [body.index(text) for text in ('Rockers</h5>', 'Rockers at Rock Hall', 'Rock Hall</h5>', 'The Old Rock Barn')]
+  assert positions == sorted(positions)
+
+
+def test_sub_search_queries_are_counted(app, client):
+  _seed(app)
+  response = client.get('/search?search_term=rock')
+  assert int(response.headers['X-DB-Query-Count']) >= 3
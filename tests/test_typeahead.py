@@ -0,0 +1,35 @@
+import sqlite3
+from instrumentation import count_queries
+from models import db, Venue
+
+
+def _names(client):
+  return sorted(hit['name'] for hit in client.get('/autocomplete?q=hall').get_json())
+
+
+def test_names_written_by_another_process_are_picked_up(app, client, db_path):
+  app.config['TYPEAHEAD_REFRESH_INTERVAL'] = 0
+  with app.app_context():
+    db.session.add(Venue(name='Brand New Hall', city='San Francisco', state='CA', address='1 Main Street'))
+    db.session.commit()
+  assert _names(client) == ['Brand New Hall']
+
+  other = sqlite3.connect(db_path)
+  with other:
+    other.execute('INSERT INTO "Venue" (name, city, state, address, updated_at, version) '
+                  "VALUES ('Hall of Fame', 'New York', 'NY', '2 Main Street', datetime('now'), 1)")
+  assert _names(client) == ['Brand New Hall', 'Hall of Fame']
+
+  with other:
+    other.execute('DELETE FROM "Venue" WHERE name = ?', ('Brand New Hall',))
+  other.close()
+  assert _names(client) == ['Hall of Fame']
+
+
+def test_idle_poll_reads_only_the_table_versions(app, client):
+  app.config['TYPEAHEAD_REFRESH_INTERVAL'] = 0
+  client.get('/autocomplete?q=hall')
+  with count_queries() as stats:
+    client.get('/autocomplete?q=hall')
+  assert stats.count == 1
+  assert all('"TableVersion"' in statement for statement in stats.statements)
@@ -0,0 +1,212 @@
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, Venue, Artist, TableVersion
+
+#----------------------------------------------------------------------------#
+# Typeahead.
+#----------------------------------------------------------------------------#
+
+# A per-process sorted array of (normalized key, kind, id) answering prefix
+# lookups with bisect. Every word start of a name is a key, so "hop" finds
+# "The Musical Hop". Commits through this process's sessions patch it in
+# place. Writes by other workers, or by `flask import`, are caught by a poll
+# at most every TYPEAHEAD_REFRESH_INTERVAL seconds. The poll reads the
+# TableVersion rows, and only when a table's version moved does it upsert the
+# rows whose updated_at moved, rebuilding when the row counts no longer match
+# (deletes).
+
+KINDS = {'venue': Venue, 'artist': Artist}
+_KIND_NAMES = {model: kind for kind, model in KINDS.items()}
+# updated_at comes from each writer's clock and is stamped before commit, so
+# the poll looks back a little past the newest stamp it has seen
+_CLOCK_SLACK = timedelta(minutes=1)
+
+
+def normalize(name):
+  name = unicodedata.normalize('NFKD', name or '')
+  name = ''.join(c for c in name if not unicodedata.combining(c))
+  return ' '.join(name.casefold().split())
+
+
+def _keys(name):
+  words = normalize(name).split(' ')
+  return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class PrefixIndex(object):
+
+    def __init__(self):
+      self._keys = []
+      self._names = {}
+      self._counts = Counter()
+      self._marks = {}
+      self._versions = {}
+      self._checked_at = 0.0
+      self._lock = threading.RLock()
+      self._refreshing = threading.Lock()
+      self.built = False
+
+    def _table_versions(self):
+      found = {name: version for name, version, _ in TableVersion._get_versions(*(model.__tablename__ for model in _KIND_NAMES))}
+      return {kind: found.get(model.__tablename__) for model, kind in _KIND_NAMES.items()}
+
+    def build(self):
+      keys, names, counts, marks = [], {}, Counter(), {}
+      # read before the names, so that writes racing the build are polled again
+      versions = self._table_versions()
+      for model, kind in _KIND_NAMES.items():
+        marks[kind] = db.session.query(db.func.max(model.updated_at)).scalar()
+        for id, name in db.session.query(model.id, model.name).yield_per(10000):
+          names[(kind, id)] = name
+          counts[kind] += 1
+          keys.extend((key, kind, id) for key in _keys(name))
+      keys.sort()
+      with self._lock:
+        self._keys, self._names, self._counts, self._marks, self.built = keys, names, counts, marks, True
+        self._versions = versions
+        self._checked_at = time.monotonic()
+
+    def ensure_built(self):
+      if not self.built:
+        with self._lock:
+          if not self.built:
+            self.build()
+
+    def ensure_fresh(self, interval):
+      if not self.built:
+        self.ensure_built()
+        return
+      if time.monotonic() - self._checked_at < interval or not self._refreshing.acquire(blocking=False):
+        return
+      try:
+        self._checked_at = time.monotonic()
+        self.refresh()
+      finally:
+        self._refreshing.release()
+
+    def refresh(self):
+      versions = self._table_versions()
+      for model, kind in _KIND_NAMES.items():
+        version = versions[kind]
+        # a missing TableVersion row cannot tell us anything, so poll the table
+        if version is not None and version == self._versions.get(kind):
+          continue
+        since = self._marks.get(kind)
+        query = db.session.query(model.id, model.name, model.updated_at)
+        if since is not None:
+          query = query.filter(model.updated_at >= since - _CLOCK_SLACK)
+        for id, name, updated_at in query:
+          self.upsert(kind, id, name)
+          if since is None or updated_at > since:
+            since = updated_at
+        self._marks[kind] = since
+        if db.session.query(db.func.count(model.id)).scalar() != self._counts[kind]:
+          # rows were deleted elsewhere
+          self.build()
+          return
+        self._versions[kind] = version
+
+    def mark_stale(self):
+      self.built = False
+
+    def upsert(self, kind, id, name):
+      with self._lock:
+        if self._names.get((kind, id)) == name:
+          return
+        self._remove(kind, id)
+        self._names[(kind, id)] = name
+        self._counts[kind] += 1
+        for key in _keys(name):
+          insort(self._keys, (key, kind, id))
+
+    def remove(self, kind, id):
+      with self._lock:
+        self._remove(kind, id)
+
+    def _remove(self, kind, id):
+      name = self._names.pop((kind, id), None)
+      if name is None:
+        return
+      self._counts[kind] -= 1
+      for key in _keys(name):
+        i = bisect_left(self._keys, (key, kind, id))
+        if i < len(self._keys) and self._keys[i] == (key, kind, id):
+          del self._keys[i]
+
+    def lookup(self, prefix, kind=None, limit=10):
+      prefix = normalize(prefix)
+      if not prefix:
+        return []
+      results, seen = [], set()
+      with self._lock:
+        i = bisect_left(self._keys, (prefix,))
+        while i < len(self._keys) and len(results) < limit:
+          key, entry_kind, id = self._keys[i]
+          if not key.startswith(prefix):
+            break
+          i += 1
+          if (kind is None or entry_kind == kind) and (entry_kind, id) not in seen:
+            seen.add((entry_kind, id))
+            results.append({'kind': entry_kind, 'id': id, 'name': self._names[(entry_kind, id)]})
+      return results
+
+    def memory_usage(self):
+      # shallow sizes of the containers, their tuples and the strings they hold
+      with self._lock:
+        total = sys.getsizeof(self._keys) + sys.getsizeof(self._names)
+        for entry in self._keys:
+          total += sys.getsizeof(entry) + sys.getsizeof(entry[0])
+        for key, name in self._names.items():
+          total += sys.getsizeof(key) + sys.getsizeof(name)
+      return {'entries': len(self._names), 'keys': len(self._keys), 'bytes': total}
+
+
+index = PrefixIndex()
+
+
+def init_typeahead(app):
+  if app.config.get('TYPEAHEAD_PRELOAD'):
+    @app.before_first_request
+    def build_typeahead_index():
+      try:
+        index.build()
+      except Exception:
+        # e.g. tables not migrated yet; the first lookup retries
+        app.logger.exception('Could not build the typeahead index')
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_name_changes(session, flush_context):
+  changes = session.info.setdefault('typeahead_changes', {})
+  for obj in list(session.new) + list(session.dirty):
+    kind = _KIND_NAMES.get(type(obj))
+    if kind is not None:
+      changes[(kind, obj.id)] = obj.name
+  for obj in session.deleted:
+    kind = _KIND_NAMES.get(type(obj))
+    if kind is not None:
+      changes[(kind, obj.id)] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_name_changes(session):
+  changes = session.info.pop('typeahead_changes', None)
+  if not changes or not index.built:
+    return
+  for (kind, id), name in changes.items():
+    if name is None:
+      index.remove(kind, id)
+    else:
+      index.upsert(kind, id, name)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_name_changes(session):
+  session.info.pop('typeahead_changes', None)
@@ -1,11 +1,33 @@
-import babel
+import babel.dates
 import dateutil.parser
+from datetime import datetime
+from functools import lru_cache
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  result = babel.dates.format_datetime(date, format)
-  return result
+DATETIME_FORMATS = {'full': "EEEE MMMM, d, y 'at' h:mma",
+                    'medium': "EE MM, dd, y h:mma"}
+
+@lru_cache(maxsize=64)
+def _compiled_pattern(format, locale):
+  return (babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)),
+          babel.Locale.parse(locale))
+
+def format_datetime(value, format='medium', locale=None):
+  # datetimes are formatted as-is; only strings go through dateutil
+  if not isinstance(value, datetime):
+    value = dateutil.parser.parse(value)
+  pattern, locale = _compiled_pattern(format, locale or babel.dates.LC_TIME)
+  return pattern.apply(value, locale)
+
+def encode_cursor(cursor):
+  start_time, show_id = cursor
+  return '{}_{}'.format(start_time.isoformat(), show_id)
+
+def decode_cursor(value):
+  start_time, _, show_id = value.rpartition('_')
+  return datetime.fromisoformat(start_time), int(show_id)
+
+def parse_date(value):
+  return datetime.strptime(value, '%Y-%m-%d')
+
+def parse_month(value):
+  return datetime.strptime(value, '%Y-%m')